@@ -0,0 +1,242 @@
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+from helpers import MicroBatchFilter
+from local_classifier import tiered_classifier
+from metrics import instrumented_run
+from persistence import MongoSink, get_collection
+from pipeline import STAGE_CONCURRENCY, email_stages, failed_items, gmail_producer, imap_producer, run_pipeline
+from prefilter import default_prefilter
+from ratelimit import gmail_execute, shared_openai_client
+from storage import get_store
+from sync_state import SyncState, mailbox_status
+from threads import process_newest_per_thread
+
+load_dotenv()
+
+CHECKPOINT_FILE = "backfill_state.json"
+SHARD_DAYS = 7
+BACKFILL_WORKERS = 4
+GMAIL_PAGE_SIZE = 500
+IMAP_CHUNK_SIZE = 200
+
+
+def date_shards(since, until, shard_days=SHARD_DAYS):
+    """Split [since, until) into consecutive windows of `shard_days` days."""
+    shards = []
+    start = since
+    while start < until:
+        end = min(start + timedelta(days=shard_days), until)
+        shards.append((start, end))
+        start = end
+    return shards
+
+
+def shard_key(source, start, end):
+    return f"{source}:{start:%Y-%m-%d}:{end:%Y-%m-%d}"
+
+
+class Checkpoints:
+    """
+    Thread-safe wrapper over a SyncState file holding one cursor per shard: a Gmail page
+    token or an IMAP UID high-water mark. Processed ids are only kept for the page or chunk
+    in progress, so a retry can skip what already went through; failure counts and dead
+    letters are kept for the whole shard.
+    """
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.state = SyncState(path, max_processed=max(GMAIL_PAGE_SIZE, IMAP_CHUNK_SIZE))
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.state.cursor(key) or {}
+
+    def is_processed(self, key, message_id):
+        with self.lock:
+            return self.state.is_processed(key, message_id)
+
+    def reset(self, key):
+        with self.lock:
+            self.state.reset(key)
+
+    def record_attempts(self, key, done_ids, failed_ids):
+        """Count a failed run for `failed_ids`; returns those not yet dead-lettered."""
+        with self.lock:
+            return set(self.state.record_attempts(key, done_ids, failed_ids))
+
+    def advance(self, key, cursor, processed_ids=()):
+        """
+        Record progress for a shard and write it to disk before moving on. `processed_ids`
+        are the handled part of an unfinished page or chunk; omit them once it is complete.
+        """
+        with self.lock:
+            if processed_ids:
+                self.state.mark_processed(key, processed_ids)
+            else:
+                self.state.clear_processed(key)
+            self.state.set_cursor(key, cursor)
+            self.state.save()
+
+
+def backfill_gmail_shard(service_factory, start, end, checkpoints, stages, prefilter=None,
+                         csv_file="job_applications.csv"):
+    """
+    Page through one date window, resuming from the saved page token.
+    `prefilter` is applied to metadata so bodies are only fetched for likely job mail.
+    """
+    key = shard_key("gmail", start, end)
+    cursor = checkpoints.get(key)
+    if cursor.get("done"):
+        return 0
+    service = service_factory()
+    store = get_store(csv_file)
+
+    def run(message_ids):
+        stats = run_pipeline(gmail_producer(service, [{'id': m} for m in message_ids], prefilter=prefilter,
+                                            is_tracked=store.find_thread), stages)
+        return {email_data.get('id') for email_data in failed_items(stats)}
+
+    query = f"-in:sent after:{int(start.timestamp())} before:{int(end.timestamp())}"
+    page_token = cursor.get("page_token")
+    handled = 0
+    while True:
+        results = gmail_execute(service.users().messages().list(
+            userId='me', q=query, maxResults=GMAIL_PAGE_SIZE, pageToken=page_token,
+        ), method="messages.list")
+        messages = [m for m in results.get('messages', []) if not checkpoints.is_processed(key, m['id'])]
+        # Pages are newest first, as process_newest_per_thread expects
+        done_ids, failed = process_newest_per_thread([(m['id'], m.get('threadId')) for m in messages], run,
+                                                     lambda thread: store.find_thread(thread) is not None)
+        handled += len(done_ids)
+        failed = checkpoints.record_attempts(key, done_ids, failed)
+        if failed:
+            # Keep the current page token so the failures are retried on the next run
+            checkpoints.advance(key, {"page_token": page_token, "done": False}, done_ids)
+            print(f"{key}: {len(failed)} messages failed, stopping shard for now.")
+            return handled
+        page_token = results.get('nextPageToken')
+        checkpoints.advance(key, {"page_token": page_token, "done": not page_token})
+        if not page_token:
+            return handled
+
+
+def imap_date(value):
+    return value.strftime("%d-%b-%Y")
+
+
+def backfill_imap_shard(connect, fetch, start, end, checkpoints, stages, mailbox="inbox", prefilter=None,
+                        thread_ids=None, csv_file="job_applications.csv"):
+    """
+    Fetch one SINCE/BEFORE window in UID chunks, checkpointing after each chunk.
+    `prefilter` is applied to headers so bodies are only fetched for likely job mail.
+    `thread_ids(mail, uids, mailbox)` groups a chunk into threads; without it every message
+    stands alone.
+    """
+    key = shard_key("imap", start, end)
+    cursor = checkpoints.get(key)
+    if cursor.get("done"):
+        return 0
+    mail = connect()
+    try:
+        mail.select(mailbox, readonly=True)
+        uidvalidity = mailbox_status(mail, mailbox, "UIDVALIDITY")
+        if cursor and cursor.get("uidvalidity") != uidvalidity:
+            print(f"{key}: UIDVALIDITY changed, restarting shard.")
+            checkpoints.reset(key)
+            cursor = {}
+        last_uid = cursor.get("last_uid", 0)
+        status, data = mail.uid("SEARCH", None, f"(SINCE {imap_date(start)} BEFORE {imap_date(end)})")
+        uids = sorted(int(u) for u in data[0].split() if int(u) > last_uid)
+        uids = [uid for uid in uids if not checkpoints.is_processed(key, uid)]
+        store = get_store(csv_file)
+
+        def run(round_uids):
+            stats = run_pipeline(imap_producer(fetch, mail, uids=round_uids, chunk_size=IMAP_CHUNK_SIZE,
+                                               prefilter=prefilter, mailbox=mailbox, is_tracked=store.find_thread),
+                                 stages)
+            return {email_data.get("uid") for email_data in failed_items(stats)}
+
+        handled = 0
+        for offset in range(0, len(uids), IMAP_CHUNK_SIZE):
+            chunk = uids[offset:offset + IMAP_CHUNK_SIZE]
+            threads = thread_ids(mail, chunk, mailbox) if thread_ids else {}
+            newest_first = sorted(chunk, reverse=True)
+            done, failed = process_newest_per_thread([(uid, threads.get(uid, "")) for uid in newest_first], run,
+                                                     lambda thread: store.find_thread(thread) is not None)
+            handled += len(done)
+            failed = checkpoints.record_attempts(key, done, failed)
+            if failed:
+                checkpoints.advance(key, {"uidvalidity": uidvalidity, "last_uid": last_uid, "done": False}, done)
+                print(f"{key}: {len(failed)} messages failed, stopping shard for now.")
+                return handled
+            last_uid = chunk[-1]
+            checkpoints.advance(key, {"uidvalidity": uidvalidity, "last_uid": last_uid, "done": False})
+        checkpoints.advance(key, {"uidvalidity": uidvalidity, "last_uid": last_uid, "done": True})
+        return handled
+    finally:
+        mail.logout()
+
+
+def run_backfill(source, since, until, shard_days=SHARD_DAYS, workers=BACKFILL_WORKERS,
+                 checkpoint_file=CHECKPOINT_FILE, csv_file="job_applications.csv", mailbox="inbox"):
+    """Process every shard of [since, until) on `workers` threads; rerunning resumes where it stopped."""
+    checkpoints = Checkpoints(checkpoint_file)
+    shards = date_shards(since, until, shard_days)
+    openaiclient = shared_openai_client()
+    # Escalations from concurrent classify workers share one LLM request
+    classifier = tiered_classifier(llm=MicroBatchFilter(max_items=STAGE_CONCURRENCY["classify"]))
+
+    prefilter = default_prefilter()
+
+    with MongoSink(get_collection()) as sink:
+        # Both sources apply the prefilter to headers before fetching bodies
+        stages = email_stages(openaiclient, sink, csv_file, classifier=classifier)
+        if source == "gmail":
+            from fetch_emails import build_gmail_service, load_credentials
+            # Sign in once; each shard builds its own service since they are not thread-safe
+            creds = load_credentials()
+            run_shard = lambda shard: backfill_gmail_shard(lambda: build_gmail_service(creds), *shard,
+                                                           checkpoints, stages, prefilter=prefilter,
+                                                           csv_file=csv_file)
+        else:
+            from fetchemails_via_imap import connect_imap, fetch_emails_imap_pipelined, imap_thread_ids
+            run_shard = lambda shard: backfill_imap_shard(connect_imap, fetch_emails_imap_pipelined,
+                                                          *shard, checkpoints, stages, mailbox=mailbox,
+                                                          prefilter=prefilter, thread_ids=imap_thread_ids,
+                                                          csv_file=csv_file)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            totals = list(pool.map(run_shard, shards))
+
+    get_store(csv_file).export_csv(csv_file)
+    print(f"Backfill processed {sum(totals)} messages across {len(shards)} shards.")
+    return sum(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import historical mail in resumable, parallel date shards.")
+    parser.add_argument("source", choices=["gmail", "imap"])
+    parser.add_argument("--since", required=True, help="YYYY-MM-DD (inclusive)")
+    parser.add_argument("--until", default=None, help="YYYY-MM-DD (exclusive, default: today)")
+    parser.add_argument("--shard-days", type=int, default=SHARD_DAYS)
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--mailbox", default="inbox", help="IMAP mailbox to import")
+    args = parser.parse_args()
+
+    parse = lambda value: datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    since = parse(args.since)
+    until = parse(args.until) if args.until else datetime.now(timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    with instrumented_run(f"backfill_{args.source}"):
+        run_backfill(args.source, since, until, args.shard_days, args.workers, args.checkpoint,
+                     mailbox=args.mailbox)
+
+
+if __name__ == "__main__":
+    main()
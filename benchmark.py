@@ -0,0 +1,328 @@
+import argparse
+import contextlib
+import email
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import synthetic_mailbox
+
+BENCH_RESULTS_DIR = "bench_results"
+BENCH_SIZES = (10, 1000, 100000)
+BENCH_STAGES = ("prefilter", "extract_gmail", "extract_imap", "gpt_filter", "update_or_add_job", "pipeline")
+# Simulated round-trip time of the stub backends, in seconds
+OPENAI_LATENCY = 0.0
+MONGO_LATENCY = 0.0
+# Cold-start imports, each timed in a fresh interpreter under `python -X importtime`
+STARTUP_TARGETS = {
+    # Everything a cron run of fetch_emails.py loads before finding no new mail
+    "gmail_no_new_mail": "import fetch_emails, google.oauth2.credentials, google.auth.transport.requests",
+    "imap_module": "import fetchemails_via_imap",
+}
+STARTUP_RUNS = 5
+
+
+class StubOpenAI:
+    """
+    Stands in for the OpenAI client: answers gpt_filter and relevance prompts from keywords
+    after sleeping `latency` seconds, and counts calls and tokens.
+    """
+
+    def __init__(self, latency=OPENAI_LATENCY):
+        self.latency = latency
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        prompt = kwargs["messages"][-1]["content"]
+        self.prompt_tokens += len(prompt) // 4
+        if self.latency:
+            time.sleep(self.latency)
+        if "Reply with the number" in prompt:
+            content = "1" if self.calls % 2 else "0"
+        else:
+            # gpt_filter puts the body between "---" lines, ahead of the answer format
+            body = prompt.split("---", 2)[1] if prompt.count("---") >= 2 else prompt
+            content = json.dumps(self._verdict(body.lower()))
+        message = SimpleNamespace(content=content)
+        usage = SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(content) // 4)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+    @staticmethod
+    def _verdict(body):
+        verdict = {"job_related": "Yes", "category": "NA", "decision": "NA", "round": "NA"}
+        if "interview" in body:
+            verdict.update(category="Got Interview", round="Round Technical")
+        elif "unfortunately" in body or "pleased to offer" in body:
+            verdict.update(category="Got Decision", decision="Reject" if "unfortunately" in body else "Success")
+        elif "application" in body or "applying" in body:
+            verdict["category"] = "Applied"
+        else:
+            verdict["job_related"] = "No"
+        return verdict
+
+
+class StubCollection:
+    """Stands in for a pymongo collection: bulk_write sleeps `latency` seconds per call."""
+
+    def __init__(self, latency=MONGO_LATENCY):
+        self.latency = latency
+        self.calls = 0
+        self.documents = 0
+
+    def create_index(self, keys, **kwargs):
+        return "_".join(field for field, _ in keys)
+
+    def bulk_write(self, operations, ordered=True):
+        self.calls += 1
+        self.documents += len(operations)
+        if self.latency:
+            time.sleep(self.latency)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if platform.system() == "Darwin" else 1024)
+
+
+def _timed(func, items):
+    latencies = []
+    for item in items:
+        started = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def _email_doc(spec, verdict=None):
+    verdict = verdict or StubOpenAI._verdict(spec["text"].lower())
+    return {"id": spec["id"], "thread_id": spec["thread_id"], "sender": spec["sender"],
+            "subject": spec["subject"], "body": spec["text"], "snippet": spec["text"][:100],
+            "category": verdict["category"], "decision": verdict["decision"], "round": verdict["round"]}
+
+
+def _bench_stage(stage, specs, workdir, openai_latency, mongo_latency):
+    """
+    Run one stage over `specs`, returning (per-email latencies, stub client or None, wall
+    seconds or None). Wall time is only given where items overlap, so their latencies
+    do not add up to the elapsed time.
+    """
+    from helpers import gpt_filter, parse_full_message
+    from llm_cache import LLMCache
+    from mime_extract import extract_from_message
+    from prefilter import Prefilter
+    import llm_cache
+    import ratelimit
+
+    client = StubOpenAI(openai_latency)
+    # Point the process-wide cache and OpenAI client at throwaway instances
+    llm_cache._default_cache = LLMCache(os.path.join(workdir, "llm_cache.sqlite3"))
+    ratelimit._openai_client = client
+
+    if stage == "prefilter":
+        prefilter = Prefilter()
+        return _timed(lambda spec: prefilter(spec["sender"], spec["subject"], spec["text"]), specs), None, None
+    if stage == "extract_gmail":
+        # Build each payload outside the timed call so only extraction is measured
+        messages = (synthetic_mailbox.to_gmail_message(spec) for spec in specs)
+        return _timed(parse_full_message, messages), None, None
+    if stage == "extract_imap":
+        raw = (synthetic_mailbox.to_rfc822(spec) for spec in specs)
+        return _timed(lambda data: extract_from_message(email.message_from_bytes(data)), raw), None, None
+    if stage == "gpt_filter":
+        return _timed(lambda spec: gpt_filter(spec["text"], client), specs), client, None
+
+    from storage import SQLiteJobStore
+    from save_to_db import update_or_add_job
+    csv_file = os.path.join(workdir, "job_applications.csv")
+    store = SQLiteJobStore(os.path.join(workdir, "job_applications.sqlite3"))
+    if stage == "update_or_add_job":
+        docs = [_email_doc(spec) for spec in specs if spec["job_related"]]
+        return _timed(lambda doc: update_or_add_job(csv_file, doc, store=store), docs), client, None
+
+    from persistence import MongoSink
+    from pipeline import email_stages, run_pipeline
+    import storage
+    storage._stores[(storage.default_backend(), os.path.abspath(csv_file))] = store
+    messages = (parse_full_message(synthetic_mailbox.to_gmail_message(spec)) for spec in specs)
+    started = time.perf_counter()
+    with MongoSink(StubCollection(mongo_latency), flush_interval=0) as sink:
+        stats = run_pipeline(messages, email_stages(client, sink, csv_file, prefilter=Prefilter()))
+    elapsed = time.perf_counter() - started
+    # End-to-end latency of every email, wherever in the pipeline it finished
+    return [latency for stage_stats in stats for latency in stage_stats.latencies], client, elapsed
+
+
+def run_one(stage, size, seed=0, openai_latency=OPENAI_LATENCY, mongo_latency=MONGO_LATENCY):
+    """Benchmark one stage at one mailbox size; meant to run in a fresh process."""
+    specs = synthetic_mailbox.generate(size, seed=seed)
+    with tempfile.TemporaryDirectory() as workdir, open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        latencies, client, wall = _bench_stage(stage, specs, workdir, openai_latency, mongo_latency)
+    # Time spent inside the measured calls only, not generating the synthetic input
+    elapsed = wall if wall is not None else sum(latencies)
+    count = len(latencies)
+    return {
+        "stage": stage,
+        "emails": size,
+        "items": count,
+        "seconds": round(elapsed, 4),
+        "emails_per_sec": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+        "llm_calls_per_email": round(client.calls / size, 4) if client else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(stages=BENCH_STAGES, sizes=BENCH_SIZES, seed=0, openai_latency=OPENAI_LATENCY,
+                   mongo_latency=MONGO_LATENCY):
+    results = []
+    for stage in stages:
+        for size in sizes:
+            # A fresh process per run keeps peak RSS and module-level caches from leaking between runs
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                result = pool.submit(run_one, stage, size, seed, openai_latency, mongo_latency).result()
+            print(f"{stage:<18} {size:>7} emails  {result['emails_per_sec']:>10.1f} emails/s  "
+                  f"p50={result['p50_ms']:.3f}ms  p99={result['p99_ms']:.3f}ms  "
+                  f"llm/email={result['llm_calls_per_email']:.3f}  rss={result['peak_rss_mb']:.0f}MB")
+            results.append(result)
+    return {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"seed": seed, "openai_latency": openai_latency, "mongo_latency": mongo_latency},
+        "results": results,
+    }
+
+
+def parse_importtime(stderr):
+    """(module, self_us, cumulative_us) for each line of `-X importtime` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        rows.append((module.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def run_startup(target, statement, runs=STARTUP_RUNS, top=10):
+    """Median import time and wall time of `statement` in fresh interpreters, with the slowest imports."""
+    import_ms, wall_ms, rows = [], [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        wall_ms.append((time.perf_counter() - started) * 1000)
+        if proc.returncode != 0:
+            return {"target": target, "statement": statement, "error": proc.stderr.strip().splitlines()[-1]}
+        rows = parse_importtime(proc.stderr)
+        import_ms.append(sum(row[1] for row in rows) / 1000)
+    slowest = sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+    return {
+        "target": target,
+        "statement": statement,
+        "runs": runs,
+        "import_ms": statistics.median(import_ms),
+        "wall_ms": statistics.median(wall_ms),
+        "modules": len(rows),
+        "slowest": [{"module": module, "cumulative_ms": cumulative / 1000} for module, _, cumulative in slowest],
+    }
+
+
+def run_startup_benchmarks(targets=STARTUP_TARGETS, runs=STARTUP_RUNS):
+    startup = []
+    for target, statement in targets.items():
+        result = run_startup(target, statement, runs)
+        if "error" in result:
+            print(f"{target:<18} failed: {result['error']}")
+        else:
+            heaviest = ", ".join(f"{m['module']} {m['cumulative_ms']:.0f}ms" for m in result["slowest"][:3])
+            print(f"{target:<18} imports={result['import_ms']:.1f}ms  wall={result['wall_ms']:.1f}ms  "
+                  f"modules={result['modules']}  heaviest: {heaviest}")
+        startup.append(result)
+    return startup
+
+
+def compare(baseline, current):
+    """Print the startup time change of each target, and the emails/sec and p99 change of each (stage, size)."""
+    print(f"Comparing {current['commit']} against {baseline['commit']}:")
+    previous = {(r["stage"], r["emails"]): r for r in baseline.get("results", [])}
+    previous_startup = {r["target"]: r for r in baseline.get("startup", []) if "error" not in r}
+    for result in current.get("startup", []):
+        old = previous_startup.get(result["target"])
+        if old and "error" not in result:
+            print(f"{result['target']:<18} startup imports {result['import_ms'] / old['import_ms'] - 1:+.1%}  "
+                  f"wall {result['wall_ms'] / old['wall_ms'] - 1:+.1%}")
+    for result in current.get("results", []):
+        old = previous.get((result["stage"], result["emails"]))
+        if not old or not old["emails_per_sec"] or not old["p99_ms"]:
+            continue
+        speed = result["emails_per_sec"] / old["emails_per_sec"] - 1
+        tail = result["p99_ms"] / old["p99_ms"] - 1
+        print(f"{result['stage']:<18} {result['emails']:>7} emails  throughput {speed:+.1%}  p99 {tail:+.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the email pipeline on a synthetic mailbox.")
+    parser.add_argument("--stages", nargs="+", choices=BENCH_STAGES, default=list(BENCH_STAGES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(BENCH_SIZES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--openai-latency", type=float, default=OPENAI_LATENCY, help="seconds per stub LLM call")
+    parser.add_argument("--mongo-latency", type=float, default=MONGO_LATENCY, help="seconds per stub bulk write")
+    parser.add_argument("--output", default=None, help=f"JSON report path (default: {BENCH_RESULTS_DIR}/<commit>.json)")
+    parser.add_argument("--compare", default=None, help="earlier JSON report to compare against")
+    parser.add_argument("--startup", action="store_true",
+                        help="measure cold-start import time instead of the pipeline stages")
+    args = parser.parse_args()
+
+    if args.startup:
+        report = {
+            "commit": git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "startup": run_startup_benchmarks(),
+        }
+    else:
+        report = run_benchmarks(args.stages, args.sizes, args.seed, args.openai_latency, args.mongo_latency)
+    output = args.output or os.path.join(BENCH_RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {output}")
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+
+
+if __name__ == "__main__":
+    main()
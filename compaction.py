@@ -0,0 +1,115 @@
+import re
+
+GPT_FILTER_TOKEN_BUDGET = 800
+RELEVANCE_TOKEN_BUDGET = 150
+# Sentences from the start of the email that are always kept (greeting + opening line).
+LEADING_SENTENCES = 2
+
+QUOTE_HEADERS = re.compile(
+    r"^(?:On .{0,200}wrote:|-{2,}\s*Original Message\s*-{2,}|-{2,}\s*Forwarded message\s*-{2,}"
+    r"|From: .+\n(?:Sent|Date): .+)",
+    re.IGNORECASE | re.MULTILINE,
+)
+SIGNATURE_MARKERS = re.compile(
+    r"^(?:-- ?$|Sent from my (?:iPhone|iPad|Android|mobile)|Get Outlook for)",
+    re.IGNORECASE | re.MULTILINE,
+)
+BOILERPLATE_LINE = re.compile(
+    r"unsubscribe|manage (?:your )?(?:email )?preferences|privacy policy|terms of (?:service|use)"
+    r"|all rights reserved|©|view (?:this email )?in (?:your )?browser|this (?:e-?mail|message) and any attachments"
+    r"|confidential(?:ity)? notice|intended (?:solely )?for the (?:use of the )?(?:individual|addressee)"
+    r"|you are receiving this|do not reply to this",
+    re.IGNORECASE,
+)
+# Longer lines that mention boilerplate usually carry the actual message as well
+BOILERPLATE_MAX_CHARS = 200
+URLS = re.compile(r"https?://\S+|www\.\S+")
+WHITESPACE = re.compile(r"[ \t\xa0]+")
+BLANK_LINES = re.compile(r"\n\s*\n+")
+SENTENCES = re.compile(r"(?<=[.!?])\s+|\n+")
+STATUS_TERMS = re.compile(
+    r"appl(?:y|ied|ication)|interview|round|offer|reject|unfortunately|regret|moving forward|next step"
+    r"|schedule|availability|assessment|coding|position|role|candida|decision|selected|congratulations",
+    re.IGNORECASE,
+)
+
+# Loaded on first use; False once tiktoken turns out to be missing
+_encoding = None
+
+
+def count_tokens(text):
+    """Token count with tiktoken's cl100k_base when available, else roughly chars/4."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:  # tiktoken is optional; fall back to a chars/4 estimate
+            _encoding = False
+    if _encoding is False:
+        return (len(text) + 3) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def is_boilerplate(line):
+    """A short footer-style line with nothing about the application in it."""
+    line = line.strip()
+    return (len(line) <= BOILERPLATE_MAX_CHARS and BOILERPLATE_LINE.search(line) is not None
+            and not STATUS_TERMS.search(line))
+
+
+def strip_noise(text):
+    """
+    Drop quoted history, signatures and boilerplate lines; collapse URLs and whitespace.
+    If nothing would be left, the original text is returned with whitespace collapsed.
+    """
+    original = text = (text or "").replace("\r\n", "\n")
+    # Cutting at offset 0 would drop a forwarded message entirely, so only cut after some content
+    match = QUOTE_HEADERS.search(text)
+    if match and text[:match.start()].strip():
+        text = text[:match.start()]
+    match = SIGNATURE_MARKERS.search(text)
+    if match and text[:match.start()].strip():
+        text = text[:match.start()]
+    lines = [line for line in text.split("\n") if not line.lstrip().startswith(">") and not is_boilerplate(line)]
+    cleaned = collapse(URLS.sub("[link]", "\n".join(lines)))
+    return cleaned or collapse(original)
+
+
+def collapse(text):
+    text = WHITESPACE.sub(" ", text)
+    return BLANK_LINES.sub("\n\n", text).strip()
+
+
+def fit_to_budget(text, budget):
+    """
+    Keep the opening sentences plus the sentences most relevant to application status,
+    in their original order, until `budget` tokens are used.
+    """
+    if count_tokens(text) <= budget:
+        return text
+    sentences = [s.strip() for s in SENTENCES.split(text) if s.strip()]
+    ranked = sorted(range(len(sentences)),
+                    key=lambda i: (i >= LEADING_SENTENCES, -len(STATUS_TERMS.findall(sentences[i])), i))
+    kept, used = set(), 0
+    for i in ranked:
+        tokens = count_tokens(sentences[i]) + 1
+        if used + tokens > budget:
+            continue
+        kept.add(i)
+        used += tokens
+    if not kept and sentences:
+        # A single huge sentence: hard-truncate by characters
+        return sentences[0][:budget * 4]
+    return " ".join(sentences[i] for i in sorted(kept))
+
+
+def compact_with_stats(text, budget=GPT_FILTER_TOKEN_BUDGET):
+    """Return (compacted_text, tokens_before, tokens_after)."""
+    before = count_tokens(text or "")
+    compacted = fit_to_budget(strip_noise(text), budget)
+    return compacted, before, count_tokens(compacted)
+
+
+def compact(text, budget=GPT_FILTER_TOKEN_BUDGET):
+    return compact_with_stats(text, budget)[0]
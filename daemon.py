@@ -0,0 +1,248 @@
+import argparse
+import imaplib
+import os
+import select
+import signal
+import ssl
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from local_classifier import tiered_classifier
+from metrics import default_metrics_dir, inc, instrumented_run, metrics, span
+from persistence import MongoSink, get_collection
+from pipeline import email_stages
+from prefilter import default_prefilter
+from ratelimit import backoff_delay, shared_openai_client
+from storage import get_store
+from sync_state import SyncState
+
+load_dotenv()
+
+CSV_FILE = "job_applications.csv"
+# Gmail history polling backs off from MIN to MAX seconds while the mailbox is quiet
+# and snaps back to MIN as soon as something arrives.
+GMAIL_POLL_MIN = float(os.getenv("GMAIL_POLL_MIN", "5"))
+GMAIL_POLL_MAX = float(os.getenv("GMAIL_POLL_MAX", "120"))
+# Servers may drop an IDLE after 30 minutes (RFC 2177), so it is re-issued before that.
+IDLE_TIMEOUT = 25 * 60
+# Fallback poll interval for IMAP servers without IDLE
+IMAP_POLL_INTERVAL = 60
+# How often a waiting watcher wakes up to check for shutdown
+STOP_CHECK_SECONDS = 1.0
+MAX_RECONNECT_DELAY = 300
+
+
+def next_poll_interval(interval, found, minimum=GMAIL_POLL_MIN, maximum=GMAIL_POLL_MAX):
+    """Adaptive poll interval: reset on new mail, otherwise grow by half up to `maximum`."""
+    return minimum if found else min(maximum, interval * 1.5)
+
+
+def has_buffered_input(mail):
+    """
+    True when imaplib's buffered reader already holds unread bytes, which select() on the
+    socket cannot see. Peeks without blocking; TLS-level buffered data is picked up too.
+    """
+    timeout = mail.sock.gettimeout()
+    mail.sock.settimeout(0)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        mail.sock.settimeout(timeout)
+
+
+def imap_idle(mail, timeout=IDLE_TIMEOUT, stop=None):
+    """
+    Issue IDLE on the selected mailbox and block until the server reports a change, `timeout`
+    seconds pass or `stop` is set. Returns True if the server sent an untagged update.
+    imaplib only has IDLE from Python 3.14, so the command is driven by hand.
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b" IDLE\r\n")
+    line = mail.readline()
+    if not line.startswith(b"+"):
+        raise imaplib.IMAP4.error(f"IDLE rejected: {line!r}")
+
+    changed = False
+    deadline = time.monotonic() + timeout
+    while not changed and time.monotonic() < deadline and not (stop and stop.is_set()):
+        # An update may have arrived with the "+ idling" line and already sit in the buffer
+        if has_buffered_input(mail) or select.select([mail.sock], [], [], STOP_CHECK_SECONDS)[0]:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            changed = b"EXISTS" in line or b"RECENT" in line or b"FETCH" in line
+
+    mail.send(b"DONE\r\n")
+    while True:
+        line = mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed while ending IDLE")
+        if line.startswith(tag):
+            if not line[len(tag):].strip().startswith(b"OK"):
+                raise imaplib.IMAP4.error(f"IDLE failed: {line!r}")
+            return changed
+
+
+class Watcher(threading.Thread):
+    """
+    Keeps one source connected and synced until `stop` is set. Failures drop the connection
+    and reconnect with exponential backoff; a sync in progress always finishes before exit.
+    """
+
+    source = None
+
+    def __init__(self, stages, stop, state, state_lock, prefilter=None):
+        super().__init__(name=self.source, daemon=True)
+        self.stages = stages
+        self.prefilter = prefilter
+        self.stop = stop
+        self.state = state
+        self.state_lock = state_lock
+        self.connection = None
+        self.failures = 0
+
+    def connect(self):
+        raise NotImplementedError
+
+    def disconnect(self):
+        self.connection = None
+
+    def wait_and_sync(self):
+        raise NotImplementedError
+
+    def sync(self, func, *args, **kwargs):
+        with self.state_lock:
+            found = func(*args, **kwargs)
+        if found:
+            get_store(CSV_FILE).export_csv(CSV_FILE)
+        metrics.write_textfile(os.path.join(default_metrics_dir(), "daemon.prom"))
+        return found
+
+    def run(self):
+        while not self.stop.is_set():
+            try:
+                if self.connection is None:
+                    self.connection = self.connect()
+                    print(f"{self.name}: connected.")
+                self.wait_and_sync()
+                self.failures = 0
+            except Exception as e:
+                inc("reconnects", source=self.name)
+                delay = min(MAX_RECONNECT_DELAY, backoff_delay(self.failures))
+                self.failures += 1
+                print(f"{self.name}: {e!r}; reconnecting in {delay:.0f}s.")
+                self.disconnect()
+                self.stop.wait(delay)
+        self.disconnect()
+        print(f"{self.name}: stopped.")
+
+
+class GmailWatcher(Watcher):
+    source = "gmail"
+
+    def __init__(self, stages, stop, state, state_lock, prefilter=None):
+        super().__init__(stages, stop, state, state_lock, prefilter)
+        self.interval = GMAIL_POLL_MIN
+
+    def connect(self):
+        from fetch_emails import authenticate_gmail
+        return authenticate_gmail()
+
+    def wait_and_sync(self):
+        from fetch_emails import sync_gmail
+        found = self.sync(sync_gmail, self.connection, self.state, self.stages, prefilter=self.prefilter)
+        self.interval = next_poll_interval(self.interval, found)
+        self.stop.wait(self.interval)
+
+
+class IMAPWatcher(Watcher):
+    source = "imap"
+
+    def __init__(self, stages, stop, state, state_lock, prefilter=None):
+        super().__init__(stages, stop, state, state_lock, prefilter)
+        self.catch_up = True
+
+    def connect(self):
+        from fetchemails_via_imap import connect_imap
+        mail = connect_imap()
+        # Servers often advertise IDLE/CONDSTORE only once logged in
+        status, data = mail.capability()
+        if status == "OK" and data:
+            mail.capabilities = tuple(data[0].decode().upper().split())
+        # Catch up on anything that arrived while disconnected before going idle
+        self.catch_up = True
+        return mail
+
+    def disconnect(self):
+        if self.connection is not None:
+            try:
+                self.connection.logout()
+            except Exception:
+                pass
+        super().disconnect()
+
+    def sync_now(self, mail):
+        from fetchemails_via_imap import sync_imap
+        return self.sync(sync_imap, mail, self.state, self.stages, prefilter=self.prefilter)
+
+    def wait_and_sync(self):
+        mail = self.connection
+        if self.catch_up:
+            self.sync_now(mail)
+            self.catch_up = False
+        # The pipelined fetch leaves "inbox" selected; IDLE needs a selected mailbox
+        mail.select("inbox", readonly=True)
+        if "IDLE" in mail.capabilities:
+            with span("idle", source="imap"):
+                changed = imap_idle(mail, stop=self.stop)
+        else:
+            self.stop.wait(IMAP_POLL_INTERVAL)
+            changed = True
+        if changed and not self.stop.is_set():
+            self.sync_now(mail)
+
+
+def run_daemon(sources):
+    """Watch `sources` until SIGINT/SIGTERM, reusing one OpenAI client and Mongo sink throughout."""
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    os.makedirs(default_metrics_dir(), exist_ok=True)
+    openaiclient = shared_openai_client()
+    prefilter = default_prefilter()
+    # Sync state is one JSON file, so watchers share it and take turns syncing
+    state = SyncState()
+    state_lock = threading.Lock()
+    with MongoSink(get_collection()) as sink:
+        # Both sources apply the prefilter to headers before fetching bodies
+        stages = email_stages(openaiclient, sink, CSV_FILE, classifier=tiered_classifier())
+        watchers = []
+        if "gmail" in sources:
+            watchers.append(GmailWatcher(stages, stop, state, state_lock, prefilter=prefilter))
+        if "imap" in sources:
+            watchers.append(IMAPWatcher(stages, stop, state, state_lock, prefilter=prefilter))
+        for watcher in watchers:
+            watcher.start()
+        print(f"Watching {', '.join(sources)}; press Ctrl+C to stop.")
+        while any(watcher.is_alive() for watcher in watchers):
+            for watcher in watchers:
+                watcher.join(STOP_CHECK_SECONDS)
+    get_store(CSV_FILE).export_csv(CSV_FILE)
+    print("Shut down cleanly.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep watching mailboxes and process new mail as it arrives.")
+    parser.add_argument("sources", nargs="+", choices=["gmail", "imap"])
+    args = parser.parse_args()
+    with instrumented_run("daemon"):
+        run_daemon(args.sources)
+
+
+if __name__ == "__main__":
+    main()
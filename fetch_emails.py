@@ -1,17 +1,10 @@
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from pymongo import MongoClient
-import re, os
+import os
 from dotenv import load_dotenv
-from google.auth.transport.requests import Request
-from openai import OpenAI
-from helpers import gpt_filter, get_body, get_full_email_details
-import base64 
-from datetime import datetime, timedelta
-
-from datetime import datetime, timedelta
-import time
+from metrics import instrumented_run, span
+from ratelimit import gmail_execute
+from storage import get_store
+from sync_state import SyncState, gmail_history_unchanged, gmail_new_messages, gmail_window_query
+from threads import process_newest_per_thread
 
 # Load environment variables
 load_dotenv()
@@ -21,71 +14,54 @@ SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 CSV_FILE = "job_applications.csv"
 
 
-SENDER_KEYWORDS = r"recruiter|careers|hiring|@company\.com"  # Add more domains/keywords
-NO_REPLY_REGEX = r"^(no-?reply|donotreply|noreply)[\w.-]*@"
-JOB_TITLE_KEYWORDS = r"job|application|interview|hiring|career|offer|update|hire|jobs"
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
+@span("auth", source="gmail")
+def load_credentials(token_file='token.json', credentials_file='credentials.json'):
+    """
+    Gmail credentials from `token_file`, reused as-is until they expire. token.json is only
+    rewritten after a refresh or a new sign-in, so most runs never touch it.
+    """
+    from google.oauth2.credentials import Credentials
 
-def authenticate_gmail():
-    """Authenticate and get Gmail API service."""
     creds = None
     # Token file stores user credentials (created after first auth)
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+    if os.path.exists(token_file):
+        creds = Credentials.from_authorized_user_file(token_file, SCOPES)
 
     # If no valid credentials, authenticate the user
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
+            from google.auth.transport.requests import Request
             creds.refresh(Request())
         else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+            from google_auth_oauthlib.flow import InstalledAppFlow
+            flow = InstalledAppFlow.from_client_secrets_file(credentials_file, SCOPES)
             creds = flow.run_local_server(port=8080)
 
         # Save credentials for future use
-        with open('token.json', 'w') as token:
+        with open(token_file, 'w') as token:
             token.write(creds.to_json())
+    return creds
 
-    # Build the Gmail API service
-    service = build('gmail', 'v1', credentials=creds)
-    return service
-
-def filter_email(sender, subject):
-    """Filter based on regex for sender keywords and no-reply heuristics."""
-    sender_email_match = re.search(r"<(.*?)>", sender)  # Extract email from "Name <email>"
-    email_address = sender_email_match.group(1) if sender_email_match else sender
 
-    if re.search(JOB_TITLE_KEYWORDS, email_address, re.IGNORECASE):
-        return "job title match"
-    if re.search(SENDER_KEYWORDS, email_address, re.IGNORECASE):
-        return " sender keyword match"
-    if re.search(NO_REPLY_REGEX, email_address, re.IGNORECASE):
-        return "No-Reply email"
+def build_gmail_service(creds):
+    """Gmail API service from the discovery document bundled with googleapiclient."""
+    from googleapiclient.discovery import build
+    return build('gmail', 'v1', credentials=creds, cache_discovery=False)
 
-    return None
 
+def authenticate_gmail(token_file='token.json', credentials_file='credentials.json'):
+    """Authenticate and get Gmail API service."""
+    return build_gmail_service(load_credentials(token_file, credentials_file))
 
  
 def fetch_emails(service, max_results=150, days=None, hours=None, unread_only=False):
-    query = ""
-
-    # Add 'is:unread' filter for unread emails
-    if unread_only:
-        query += "is:unread "
-
-    # Add 'after' filter for time range
-    if hours:
-        now = datetime.utcnow()  # Use UTC time for consistency
-        past_time = now - timedelta(hours=hours)
-        unix_timestamp = int(time.mktime(past_time.timetuple()))
-        query += f"after:{unix_timestamp} "
-
-    query = query.strip()
+    query = gmail_window_query(hours=hours, unread_only=unread_only)
     print(f"Query: {query}")  # Debugging: Output the constructed query
 
     # Fetch messages
     try:
-        results = service.users().messages().list(userId='me', maxResults=max_results, q=query).execute()
+        results = gmail_execute(service.users().messages().list(userId='me', maxResults=max_results, q=query),
+                                method="messages.list")
         messages = results.get('messages', [])
         print(f"Found {len(messages)} messages.")
         return messages
@@ -103,47 +79,65 @@ def list_emails(service):
         print(f"Message ID: {msg['id']}")
 
 def main():
-
-    openaiclient = OpenAI()
-
-    saved_dictionaries = []
-
-    service = authenticate_gmail()
-
-    db_password = os.getenv("DB_PASSWORD")
-    uri = os.getenv("URI")
-    uri = uri.replace("<db_password>", db_password)
-    client = MongoClient(uri)
-    db = client.email_app
-    collection = db.filtered_emails
-    # Fetch and filter emails
-    messages = fetch_emails(service, unread_only=0, hours=1)
-    print("Filtering emails...")
-    for msg in messages:
-
-        emaildump = get_full_email_details(service, msg['id'])        
-        sender, subject, body, snippet = emaildump['sender'], emaildump['subject'], emaildump['body'], emaildump['snippet']
-        filter_result = filter_email(sender, subject)
-        # exit()
-        if filter_result:
-            print(f" {sender} | {subject} | Filter: {filter_result}")
-
-            filtered_info = gpt_filter(body=body, client=openaiclient)
-            if filtered_info['job_related'] == 'Yes':
-                email_doc = {
-                    "sender": sender,
-                    "subject": subject,
-                    "body": body,
-                    "snippet": snippet,
-                    "category": filtered_info.get('category',"NA"),
-                    "decision": filtered_info.get('decision',"NA"),
-                    "round": filtered_info.get('round', "NA"),
-                }
-                saved_dictionaries.append(email_doc)
-                update_or_add_job(CSV_FILE, email_doc)
-                
-                collection.insert_one(email_doc)
-                print(f"Saved: {sender} | {subject} | Filter: {filter_result}")
+    with instrumented_run("fetch_emails"):
+        run()
+
+
+def sync_gmail(service, state, stages, hours=1, prefilter=None, csv_file=CSV_FILE):
+    """
+    Run mail added since the stored cursor through `stages` and save the new cursor.
+    Threads go newest message first: once one leaves the thread with a job row, the older
+    new messages in it are superseded; otherwise the next older one is tried. `prefilter` is
+    applied to metadata (From, Subject, snippet) so full bodies are only downloaded for
+    likely job mail. Returns the number of new messages seen.
+    """
+    from pipeline import failed_items, gmail_producer, run_pipeline
+
+    # Fetch only mail added since the last run (falls back to the last hour on first run)
+    messages, cursor = gmail_new_messages(service, state, hours=hours)
+    failed = set()
+    if messages:
+        print("Filtering emails...")
+        store = get_store(csv_file)
+
+        def run(message_ids):
+            stats = run_pipeline(gmail_producer(service, [{'id': m} for m in message_ids], prefilter=prefilter,
+                                                is_tracked=store.find_thread), stages)
+            return {email_data.get('id') for email_data in failed_items(stats)}
+
+        done, failed = process_newest_per_thread([(msg['id'], msg.get('threadId')) for msg in messages], run,
+                                                 lambda thread: store.find_thread(thread) is not None)
+        state.mark_processed("gmail", done)
+        # Messages that keep failing are dead-lettered rather than retried forever
+        failed = set(state.record_attempts("gmail", done, failed))
+
+    # Leave the cursor where it was if anything failed, so those messages are retried
+    if not failed:
+        state.set_cursor("gmail", cursor)
+    state.save()
+    return len(messages)
+
+
+def run():
+    state = SyncState()
+    creds = load_credentials()
+    # Cron-style runs mostly find nothing new; stop before loading the API client and pipeline
+    if gmail_history_unchanged(creds, state):
+        print("No new mail.")
+        return
+
+    from local_classifier import tiered_classifier
+    from persistence import MongoSink, get_collection
+    from pipeline import email_stages
+    from prefilter import default_prefilter
+    from ratelimit import shared_openai_client
+
+    openaiclient = shared_openai_client()
+    service = build_gmail_service(creds)
+    with MongoSink(get_collection()) as sink:
+        stages = email_stages(openaiclient, sink, CSV_FILE, classifier=tiered_classifier())
+        sync_gmail(service, state, stages, prefilter=default_prefilter())
+    get_store(CSV_FILE).export_csv(CSV_FILE)
 
 
 if __name__ == "__main__":
@@ -3,11 +3,11 @@ import email
 from email.header import decode_header
 import re, os
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-from pymongo import MongoClient
-from openai import OpenAI
-from helpers import gpt_filter
-from save_to_db import update_or_add_job
+from mime_extract import extract_from_message
+from storage import get_store
+from metrics import inc, instrumented_run, span
+from sync_state import SyncState, imap_new_uids
+from threads import imap_thread_id, process_newest_per_thread
 
 # Load environment variables
 load_dotenv()
@@ -18,9 +18,15 @@ EMAIL_ACCOUNT = "yash.more@alumni.ashoka.edu.in"  # Replace with your Gmail acco
 PASSWORD = os.getenv("EMAIL_PASSWORD")
 CSV_FILE = "job_applications.csv"
 
-SENDER_KEYWORDS = r"recruiter|careers|hiring|@company\.com"
-NO_REPLY_REGEX = r"^(no-?reply|donotreply|noreply)[\w.-]*@"
-JOB_TITLE_KEYWORDS = r"job|application|interview|hiring|career|offer|update|hire|jobs"
+# Pipelined fetch: headers first, then a capped slice of the body for prefilter survivors.
+# Content-Type/Transfer-Encoding are needed to parse the BODY[TEXT] slice afterwards.
+HEADER_FIELDS = "FROM SUBJECT DATE MESSAGE-ID IN-REPLY-TO REFERENCES CONTENT-TYPE CONTENT-TRANSFER-ENCODING"
+THREAD_HEADER_FIELDS = "MESSAGE-ID IN-REPLY-TO REFERENCES"
+# Messages handled on a mailbox's first sync, before there is a cursor
+FIRST_RUN_MESSAGES = 10
+BODY_PEEK_BYTES = 32 * 1024
+UIDS_PER_FETCH = 500
+UID_REGEX = re.compile(rb"UID (\d+)")
 
 
 def fetch_emails_imap(unread_only=False, max_emails=10):
@@ -52,20 +58,9 @@ def fetch_emails_imap(unread_only=False, max_emails=10):
                 if isinstance(response_part, tuple):
                     # Parse the email
                     msg = email.message_from_bytes(response_part[1])
-                    subject, encoding = decode_header(msg["Subject"])[0]
-                    if isinstance(subject, bytes):
-                        subject = subject.decode(encoding if encoding else "utf-8")
+                    subject = decode_subject(msg)
                     from_ = msg.get("From")
-
-                    # Extract body
-                    body = ""
-                    if msg.is_multipart():
-                        for part in msg.walk():
-                            content_type = part.get_content_type()
-                            if content_type == "text/plain" and part.get_payload(decode=True):
-                                body = part.get_payload(decode=True).decode()
-                    else:
-                        body = msg.get_payload(decode=True).decode()
+                    body = extract_body(msg)
 
                     fetched_emails.append({"sender": from_, "subject": subject, "body": body, "snippet": body[:100]})
         mail.logout()
@@ -77,61 +72,215 @@ def fetch_emails_imap(unread_only=False, max_emails=10):
 
 
 
-def filter_email(sender, subject):
-    """Filter based on regex for sender keywords and no-reply heuristics."""
-    sender_email_match = re.search(r"<(.*?)>", sender)  # Extract email from "Name <email>"
-    email_address = sender_email_match.group(1) if sender_email_match else sender
+def decode_subject(msg):
+    """Decode the (possibly RFC 2047 encoded) Subject header of a parsed message."""
+    if msg["Subject"] is None:
+        return ""
+    subject, encoding = decode_header(msg["Subject"])[0]
+    if isinstance(subject, bytes):
+        subject = subject.decode(encoding if encoding else "utf-8")
+    return subject
+
+
+@span("extract", source="imap")
+def extract_body(msg):
+    """Return the body text of a parsed message (text/plain preferred, HTML stripped otherwise)."""
+    return extract_from_message(msg)
+
+
+def uid_set(uids):
+    """Compress UIDs into an IMAP sequence set, e.g. [1, 2, 3, 7] -> '1:3,7'."""
+    uids = sorted(int(u) for u in uids)
+    ranges = []
+    for uid in uids:
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(f"{a}:{b}" if a != b else f"{a}" for a, b in ranges)
+
+
+def parse_fetch_response(msg_data):
+    """Map UID -> literal bytes from an imaplib FETCH response."""
+    parts = {}
+    for response_part in msg_data:
+        if isinstance(response_part, tuple):
+            match = UID_REGEX.search(response_part[0])
+            if match:
+                parts[int(match.group(1))] = response_part[1]
+    return parts
+
+
+@span("fetch", source="imap")
+def uid_fetch(mail, uids, items):
+    """Issue one UID FETCH per chunk of UIDS_PER_FETCH uids and merge the results."""
+    uids = list(uids)
+    fetched = {}
+    for start in range(0, len(uids), UIDS_PER_FETCH):
+        status, msg_data = mail.uid("FETCH", uid_set(uids[start:start + UIDS_PER_FETCH]), items)
+        if status == "OK":
+            parts = parse_fetch_response(msg_data)
+            inc("bytes_fetched", sum(len(data) for data in parts.values()), source="imap")
+            fetched.update(parts)
+    return fetched
+
 
-    if re.search(JOB_TITLE_KEYWORDS, email_address, re.IGNORECASE):
-        return "job title match"
-    if re.search(SENDER_KEYWORDS, email_address, re.IGNORECASE):
-        return "sender keyword match"
-    if re.search(NO_REPLY_REGEX, email_address, re.IGNORECASE):
-        return "No-Reply email"
+@span("auth", source="imap")
+def connect_imap(server=IMAP_SERVER, account=EMAIL_ACCOUNT, password=None):
+    mail = imaplib.IMAP4_SSL(server)
+    mail.login(account, password or PASSWORD)
+    return mail
 
-    return None
+
+def fetch_emails_imap_pipelined(unread_only=False, max_emails=10, prefilter=None,
+                                body_bytes=BODY_PEEK_BYTES, mail=None, uids=None, is_tracked=None,
+                                mailbox="inbox"):
+    """
+    Fetch emails with multi-UID FETCH commands and BODY.PEEK, so nothing is marked \\Seen.
+
+    Pass 1 pulls only a few header fields for every UID; `prefilter(sender, subject)` decides
+    which messages are worth a second pass, which pulls at most `body_bytes` of BODY[TEXT].
+    Pass `mail` to reuse an already authenticated IMAP4 connection (or a local stand-in),
+    and `uids` to fetch exactly those messages (e.g. from `sync_state.imap_new_uids`) in `mailbox`.
+    Errors are only swallowed when the function owns the connection; a caller passing `mail`
+    sees them, so it can avoid advancing a sync cursor past mail it never received.
+
+    Each message carries its thread key from References/In-Reply-To. `is_tracked(thread_id)`
+    lets replies in threads that are already known jobs bypass the prefilter.
+    """
+    own_connection = mail is None
+    try:
+        if own_connection:
+            mail = connect_imap()
+        mail.select(mailbox, readonly=True)
+
+        if uids is None:
+            search_criteria = "UNSEEN" if unread_only else "ALL"
+            status, messages = mail.uid("SEARCH", None, search_criteria)
+            uids = [int(u) for u in messages[0].split()]
+            print(f"Total emails found: {len(uids)} (Mode: {'Unread' if unread_only else 'All'})")
+            # Latest emails first
+            uids = sorted(uids, reverse=True)[:max_emails]
+        else:
+            uids = sorted(uids, reverse=True)
+        headers = uid_fetch(mail, uids, f"(UID BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])")
+
+        candidates = []
+        for uid in uids:
+            if uid not in headers:
+                continue
+            header_msg = email.message_from_bytes(headers[uid])
+            thread_id = imap_thread_id(header_msg.get("Message-ID", ""), header_msg.get("In-Reply-To", ""),
+                                       header_msg.get("References", ""))
+            sender, subject = header_msg.get("From", ""), decode_subject(header_msg)
+            if (prefilter is None or prefilter(sender, subject)
+                    or (is_tracked is not None and is_tracked(thread_id))):
+                candidates.append((uid, sender, subject, thread_id))
+
+        bodies = uid_fetch(mail, [uid for uid, _, _, _ in candidates],
+                           f"(UID BODY.PEEK[TEXT]<0.{body_bytes}>)")
+
+        fetched_emails = []
+        for uid, sender, subject, thread_id in candidates:
+            msg = email.message_from_bytes(headers[uid].rstrip(b"\r\n") + b"\r\n\r\n" + bodies.get(uid, b""))
+            body = extract_body(msg)
+            fetched_emails.append({"uid": uid, "message_id": msg.get("Message-ID", ""), "thread_id": thread_id,
+                                   "sender": sender, "subject": subject, "body": body, "snippet": body[:100]})
+        if own_connection:
+            mail.logout()
+        return fetched_emails
+
+    except Exception as e:
+        if not own_connection:
+            raise
+        print(f"Error fetching emails: {e}")
+        return []
+
+
+def imap_thread_ids(mail, uids, mailbox="inbox"):
+    """Thread key of each of `uids`, from its id headers alone."""
+    mail.select(mailbox, readonly=True)
+    headers = uid_fetch(mail, uids, f"(UID BODY.PEEK[HEADER.FIELDS ({THREAD_HEADER_FIELDS})])")
+    threads = {}
+    for uid, data in headers.items():
+        msg = email.message_from_bytes(data)
+        threads[uid] = imap_thread_id(msg.get("Message-ID", ""), msg.get("In-Reply-To", ""),
+                                      msg.get("References", ""))
+    return threads
 
 
 def main():
-    openaiclient = OpenAI()
-
-    saved_dictionaries = []
-
-    # MongoDB setup
-    db_password = os.getenv("DB_PASSWORD")
-    uri = os.getenv("URI").replace("<db_password>", db_password)
-    client = MongoClient(uri)
-    db = client.email_app
-    collection = db.filtered_emails
-
-    # Fetch unread emails using IMAP
-    print("Fetching unread emails...")
-    emails = fetch_emails_imap()
-
-    print("Filtering emails...")
-    for email_data in emails:
-        sender, subject, body, snippet = email_data["sender"], email_data["subject"], email_data["body"], email_data["snippet"]
-        # filter_result = filter_email(sender, subject)
-        
-        # if filter_result:
-        print(f" {sender} | {subject} | ")
-
-        # Call GPT-based filtering
-        filtered_info = gpt_filter(body=body, client=openaiclient)
-        if filtered_info.get('job_related') == 'Yes':
-            email_doc = {
-                "sender": sender,
-                "subject": subject,
-                "body": body,
-                "category": filtered_info.get('category', "NA"),
-                "decision": filtered_info.get('decision', "NA"),
-                "round": filtered_info.get('round', "NA"),
-                "snippet":snippet,
-            }
-            saved_dictionaries.append(email_doc)
-            update_or_add_job(CSV_FILE, email_doc)
-            collection.insert_one(email_doc)
-            # print(f"Saved: {sender} | {subject} | Filter: {filter_result}")
+    with instrumented_run("fetch_emails_imap"):
+        run()
+
+
+def imap_source(account=EMAIL_ACCOUNT, mailbox="inbox"):
+    return f"imap:{account}:{mailbox}"
+
+
+def sync_imap(mail, state, stages, source=None, prefilter=None, csv_file=CSV_FILE):
+    """
+    Run mail that arrived since the stored cursor (newest 10 on first run) through `stages`
+    over the already connected `mail`, and save the new cursor. Threads are handled newest
+    message first, as in fetch_emails.sync_gmail. Returns the number of messages that
+    survived the header prefilter.
+    """
+    from pipeline import failed_items, imap_producer, run_pipeline
+
+    source = source or imap_source()
+    uids, cursor = imap_new_uids(mail, state, source)
+    if uids is None:
+        mail.select("inbox", readonly=True)
+        status, data = mail.uid("SEARCH", None, "ALL")
+        uids = sorted((int(u) for u in data[0].split()), reverse=True)[:FIRST_RUN_MESSAGES]
+    processed = []
+    failed = set()
+    if uids:
+        print("Filtering emails...")
+        store = get_store(csv_file)
+
+        def run(round_uids):
+            def produce():
+                # Only headers are scored here; bodies are fetched for survivors alone
+                for email_data in imap_producer(fetch_emails_imap_pipelined, mail, uids=round_uids,
+                                                prefilter=prefilter, is_tracked=store.find_thread):
+                    processed.append(email_data["uid"])
+                    yield email_data
+
+            stats = run_pipeline(produce(), stages)
+            return {email_data.get("uid") for email_data in failed_items(stats)}
+
+        threads = imap_thread_ids(mail, uids)
+        items = [(uid, threads.get(uid, "")) for uid in sorted(uids, reverse=True)]
+        done, failed = process_newest_per_thread(items, run, lambda thread: store.find_thread(thread) is not None)
+        state.mark_processed(source, done)
+        # Messages that keep failing are dead-lettered rather than retried forever
+        failed = set(state.record_attempts(source, done, failed))
+
+    # Leave the cursor where it was if anything failed, so those messages are retried
+    if not failed:
+        state.set_cursor(source, cursor)
+    state.save()
+    return len(processed)
+
+
+def run():
+    from local_classifier import tiered_classifier
+    from persistence import MongoSink, get_collection
+    from pipeline import email_stages
+    from prefilter import default_prefilter
+    from ratelimit import shared_openai_client
+
+    openaiclient = shared_openai_client()
+
+    print("Fetching new emails...")
+    state = SyncState()
+    mail = connect_imap()
+    with MongoSink(get_collection()) as sink:
+        stages = email_stages(openaiclient, sink, CSV_FILE, classifier=tiered_classifier())
+        sync_imap(mail, state, stages, prefilter=default_prefilter())
+    mail.logout()
+    get_store(CSV_FILE).export_csv(CSV_FILE)
 
 
 if __name__ == "__main__":
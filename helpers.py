@@ -1,13 +1,29 @@
-import os, json, base64
-from bs4 import BeautifulSoup  # For stripping HTML tags (optional)
+import json, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from compaction import compact_with_stats
+from llm_cache import cache_key, get_default_cache
+from metrics import inc, record_completion, span
+from mime_extract import extract_from_gmail_payload
+from ratelimit import RETRYABLE_STATUS, backoff_delay, gmail_bucket, gmail_execute, http_status, retry_after
 
+# Gmail caps batch requests at 100 calls and recommends staying at or below 50.
+GMAIL_BATCH_SIZE = 50
+# Headers requested by the metadata-only first pass
+METADATA_HEADERS = ['From', 'Subject']
 
+GPT_FILTER_MODEL = "gpt-4o"
+# Bump whenever the classification prompt changes so cached verdicts are not reused.
+# "2": verdicts cached before compaction stopped emptying bodies that mention boilerplate.
+GPT_FILTER_PROMPT_VERSION = "2"
+GPT_FILTER_BATCH_PROMPT_VERSION = "2"
 
-def gpt_filter(body, client):
-    prompt = f"""
-You are an assistant that classifies job-related emails based on their content. Analyze the following email and classify it into one of the following categories:
+# Batched classification: bodies are truncated and packed until the token estimate is reached.
+BATCH_BODY_CHARS = 4000
+MAX_TOKENS_PER_BATCH = 8000
+CHARS_PER_TOKEN = 4
+VALID_CATEGORIES = {"Applied", "Got Interview", "Got Decision", "NA"}
 
-1. Applied: Indicates that the email confirms the submission of a job application.
+CLASSIFICATION_CATEGORIES = """1. Applied: Indicates that the email confirms the submission of a job application.
 2. Got Interview: Indicates that the email invites the candidate to an interview or provides interview details. Also specify the round of the interview (e.g., "Round 1", "Round 2", or "Final Round").
 - If its a specific round i.e it mentions the round number, then specify the round number.
 - If its a general interview invite, then specify the type of round i,e <TYPE> that can be coding/phonecall/test based on the body of the email.
@@ -15,7 +31,37 @@ You are an assistant that classifies job-related emails based on their content.
 - "Success" if the candidate passed.
 - "Reject" if the candidate was not selected.
 4. Not Job-Related: If the email is not related to a job application or interview process.
+"""
+
+
+def compact_body(body):
+    """Compact an email body for classification and report the tokens saved."""
+    compacted, before, after = compact_with_stats(body)
+    if before != after:
+        print(f"Compacted body: {before} -> {after} tokens ({before - after} saved)")
+    return compacted
 
+
+def gpt_filter_key(body):
+    """Cache key of gpt_filter's verdict for an already compacted body."""
+    return cache_key("gpt_filter", GPT_FILTER_MODEL, GPT_FILTER_PROMPT_VERSION, body)
+
+
+def gpt_filter(body, client, cache=None, compacted=False, check_cache=True):
+    cache = cache or get_default_cache()
+    if not compacted:
+        body = compact_body(body)
+    key = gpt_filter_key(body)
+    # Every empty body would share one key, so empty bodies are never cached
+    use_cache = bool(body.strip())
+    cached = cache.get(key) if check_cache and use_cache else None
+    if cached is not None:
+        return cached
+
+    prompt = f"""
+You are an assistant that classifies job-related emails based on their content. Analyze the following email and classify it into one of the following categories:
+
+{CLASSIFICATION_CATEGORIES}
 Here is the email content:
 ---
 {body}
@@ -29,50 +75,265 @@ Please respond strictly in the following JSON format:
 "round": "Round <TYPE>" (only required if category is 'Got Interview', else 'NA')
 }}
 """
-    completion = client.chat.completions.create(
-    model="gpt-4o",
-    messages=[
-        {"role": "developer", "content": "You are a helpful assistant."},
-        {"role": "user", "content": f"{prompt}"}]
-    )
-
-    possible_json = completion.choices[0].message.content
-    possible_json = possible_json.strip('`').strip()
-    possible_json = possible_json.strip("json")
-    print(possible_json)
-    try:
-        json_response = eval(possible_json)
-    except json.JSONDecodeError:
-        json_response = None
+    with span("llm", purpose="gpt_filter"):
+        completion = client.chat.completions.create(
+        model=GPT_FILTER_MODEL,
+        messages=[
+            {"role": "developer", "content": "You are a helpful assistant."},
+            {"role": "user", "content": f"{prompt}"}]
+        )
+    record_completion(completion, "gpt_filter", GPT_FILTER_MODEL)
 
+    json_response = parse_model_json(completion.choices[0].message.content)
+    # Prose or off-schema answers are neither cached nor returned, so the email is retried later
+    if not is_valid_verdict(json_response):
+        print("gpt_filter: model answer is not a valid verdict")
+        return None
+
+    if use_cache:
+        cache.set(key, json_response)
     return json_response
 
 
+def parse_model_json(text):
+    """Parse a JSON answer from the model, tolerating ```json fences."""
+    text = (text or "").strip().strip('`').strip()
+    if text.startswith("json"):
+        text = text[4:]
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def is_valid_verdict(verdict):
+    return (isinstance(verdict, dict)
+            and verdict.get("job_related") in ("Yes", "No")
+            and verdict.get("category", "NA") in VALID_CATEGORIES)
+
+
+def build_batch_prompt(items):
+    """Prompt classifying several (id, body) pairs at once; the instructions are sent only once."""
+    emails = "\n".join(f"=== EMAIL {item_id} ===\n{body[:BATCH_BODY_CHARS]}" for item_id, body in items)
+    return f"""
+You are an assistant that classifies job-related emails based on their content. Analyze each of the following emails and classify it into one of the following categories:
+
+{CLASSIFICATION_CATEGORIES}
+Here are the emails:
+{emails}
+
+Please respond strictly with a JSON array containing one object per email, in this format:
+[{{
+"id": <EMAIL number>,
+"job_related": "Yes" or "No",
+"category": "Applied" or "Got Interview" or "Got Decision" or "NA",
+"decision": "Success" or "Reject" ( if category is 'Got Decision', else 'NA'),
+"round": "Round <TYPE>" (only required if category is 'Got Interview', else 'NA')
+}}]
+"""
+
+
+def pack_batches(items, max_tokens_per_batch=MAX_TOKENS_PER_BATCH):
+    """Group (id, body) pairs so each group's estimated prompt size stays under the budget."""
+    batches, current, current_tokens = [], [], 0
+    for item_id, body in items:
+        tokens = min(len(body), BATCH_BODY_CHARS) // CHARS_PER_TOKEN + 10
+        if current and current_tokens + tokens > max_tokens_per_batch:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append((item_id, body))
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def batch_cache_key(body):
+    """Batch verdicts use their own prompt on truncated bodies, so they are cached apart from gpt_filter's."""
+    return cache_key("gpt_filter_batch", GPT_FILTER_MODEL, GPT_FILTER_BATCH_PROMPT_VERSION, body)
+
+
+def gpt_filter_batch(bodies, client, max_tokens_per_batch=MAX_TOKENS_PER_BATCH, cache=None, compacted=False):
+    """
+    Classify many email bodies with as few requests as possible.
+
+    Returns verdicts in the order of `bodies`. Cached bodies are answered locally, the rest are
+    packed into shared prompts; any item missing from or invalid in the JSON array answer is
+    retried on its own through `gpt_filter`.
+    """
+    cache = cache or get_default_cache()
+    if not compacted:
+        bodies = [compact_body(body) for body in bodies]
+    results = [None] * len(bodies)
+    pending = []
+    for i, body in enumerate(bodies):
+        if not body.strip():
+            results[i] = gpt_filter(body, client, cache=cache, compacted=True)
+            continue
+        # A single-email verdict saw the whole body, so it is preferred over a batch one
+        cached = cache.get(gpt_filter_key(body))
+        if cached is None:
+            cached = cache.get(batch_cache_key(body))
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.append((i, body))
+
+    for batch in pack_batches(pending, max_tokens_per_batch):
+        with span("llm", purpose="gpt_filter_batch"):
+            completion = client.chat.completions.create(
+                model=GPT_FILTER_MODEL,
+                messages=[
+                    {"role": "developer", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": build_batch_prompt(batch)}]
+            )
+        record_completion(completion, "gpt_filter_batch", GPT_FILTER_MODEL)
+        answer = parse_model_json(completion.choices[0].message.content)
+        verdicts = {}
+        if isinstance(answer, list):
+            verdicts = {item.get("id"): item for item in answer if isinstance(item, dict)}
+
+        for i, body in batch:
+            verdict = verdicts.get(i)
+            if is_valid_verdict(verdict):
+                verdict = {k: v for k, v in verdict.items() if k != "id"}
+                cache.set(batch_cache_key(body), verdict)
+                results[i] = verdict
+            else:
+                results[i] = gpt_filter(body, client, cache=cache, compacted=True)
+    return results
+
+
+class MicroBatchFilter:
+    """
+    Drop-in for gpt_filter that classifies concurrent callers together through gpt_filter_batch.
+    The first caller waits up to `max_wait` seconds for up to `max_items` bodies, sends them in
+    one request and hands every waiting caller its own verdict.
+    """
+
+    def __init__(self, max_items=8, max_wait=0.05):
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self._pending = []
+        self._cond = threading.Condition()
+
+    def __call__(self, body, client, cache=None, compacted=False, check_cache=True):
+        if not compacted:
+            body = compact_body(body)
+        future = Future()
+        with self._cond:
+            self._pending.append((body, future))
+            leader = len(self._pending) == 1
+            if leader:
+                deadline = time.monotonic() + self.max_wait
+                while len(self._pending) < self.max_items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, []
+            elif len(self._pending) >= self.max_items:
+                self._cond.notify_all()
+        if leader:
+            try:
+                verdicts = gpt_filter_batch([b for b, _ in batch], client, cache=cache, compacted=True)
+            except BaseException as e:
+                for _, waiting in batch:
+                    waiting.set_exception(e)
+            else:
+                for (_, waiting), verdict in zip(batch, verdicts):
+                    waiting.set_result(verdict)
+        return future.result()
+
+
+def write_batch_jsonl(bodies, path, max_tokens_per_batch=MAX_TOKENS_PER_BATCH):
+    """
+    Write packed classification requests as an OpenAI Batch API input file for offline backfills.
+    Each request's custom_id lists the indexes of the bodies it covers, e.g. "3,4,5".
+    """
+    bodies = [compact_body(body) for body in bodies]
+    with open(path, "w") as file:
+        for batch in pack_batches(list(enumerate(bodies)), max_tokens_per_batch):
+            request = {
+                "custom_id": ",".join(str(i) for i, _ in batch),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": GPT_FILTER_MODEL,
+                    "messages": [
+                        {"role": "developer", "content": "You are a helpful assistant."},
+                        {"role": "user", "content": build_batch_prompt(batch)}],
+                },
+            }
+            file.write(json.dumps(request) + "\n")
+
+
+def read_batch_jsonl(path, bodies, cache=None):
+    """
+    Read an OpenAI Batch API output file produced from `write_batch_jsonl(bodies, ...)`.
+    Valid verdicts are stored in the classification cache; returns verdicts in the order of
+    `bodies`, with None for items that need an online `gpt_filter` retry.
+    """
+    cache = cache or get_default_cache()
+    bodies = [compact_body(body) for body in bodies]
+    results = [None] * len(bodies)
+    with open(path, "r") as file:
+        for line in file:
+            record = json.loads(line)
+            # Only the bodies this request was sent can be answered by it
+            requested = {int(i) for i in record.get("custom_id", "").split(",") if i.strip().isdigit()}
+            response = (record.get("response") or {}).get("body") or {}
+            choices = response.get("choices") or [{}]
+            answer = parse_model_json(choices[0].get("message", {}).get("content"))
+            if not isinstance(answer, list):
+                continue
+            for item in answer:
+                if not isinstance(item, dict) or not is_valid_verdict(item):
+                    continue
+                i = item.get("id")
+                if isinstance(i, int) and i in requested and i < len(bodies):
+                    verdict = {k: v for k, v in item.items() if k != "id"}
+                    if bodies[i].strip():
+                        cache.set(batch_cache_key(bodies[i]), verdict)
+                    results[i] = verdict
+    return results
+
+
 
 def get_minified_email_details(service, message_id):
     """Get email sender, subject, and snippet."""
-    message = service.users().messages().get(userId='me', id=message_id, format='metadata', metadataHeaders=['From', 'Subject']).execute()
-    headers = message['payload']['headers']
-    sender = subject = ""
-    for header in headers:
-        if header['name'] == 'From':
-            sender = header['value']
-        if header['name'] == 'Subject':
-            subject = header['value']
-    snippet = message.get('snippet', '')
+    message = gmail_execute(service.users().messages().get(userId='me', id=message_id, format='metadata', metadataHeaders=METADATA_HEADERS))
+    details = parse_metadata_message(message)
+    return details['sender'], details['subject'], details['snippet']
+
 
-    return sender, subject, snippet
+def parse_metadata_message(message):
+    """Turn a Gmail `format='metadata'` message resource into a dict without a body."""
+    headers = {header['name']: header['value'] for header in message.get('payload', {}).get('headers', [])}
+    return {
+        'id': message.get('id'),
+        'thread_id': message.get('threadId'),
+        'sender': headers.get('From', ""),
+        'subject': headers.get('Subject', ""),
+        'body': "",
+        'snippet': message.get('snippet', ''),
+    }
 
 
 def get_full_email_details(service, message_id):
     """Get email sender, subject, and full text body."""
     # Retrieve the full email message
-    message = service.users().messages().get(
+    message = gmail_execute(service.users().messages().get(
         userId='me',
         id=message_id,
         format='full',
-    ).execute()
-    
+    ))
+    return parse_full_message(message)
+
+
+@span("extract", source="gmail")
+def parse_full_message(message):
+    """Turn a Gmail `format='full'` message resource into the sender/subject/body/snippet dict."""
     headers = message['payload']['headers']
     sender = subject = ""
 
@@ -85,40 +346,11 @@ def get_full_email_details(service, message_id):
 
     snippet = message.get('snippet', '')
 
-    # Enhanced recursive function to handle all MIME types
-    def extract_text(payload):
-        """Recursively extract text content from all MIME types."""
-        # If 'parts' exists, process recursively
-        if 'parts' in payload:
-            # Prioritize text/plain but fallback to text/html
-            all_text = []
-            for part in payload['parts']:
-                text = extract_text(part)
-                if text:
-                    all_text.append(text)
-            return "\n".join(all_text).strip()
-
-        # Handle single MIME type
-        mime_type = payload.get('mimeType', '')
-        body_data = payload.get('body', {}).get('data', '')
-
-        if body_data:
-            decoded_bytes = base64.urlsafe_b64decode(body_data.encode('UTF-8'))
-            decoded_text = decoded_bytes.decode('UTF-8', errors='ignore')
-
-            # Prioritize text/plain over text/html
-            if mime_type == 'text/plain':
-                return decoded_text.strip()
-            elif mime_type == 'text/html':
-                # Use BeautifulSoup to strip HTML tags
-                return BeautifulSoup(decoded_text, 'html.parser').get_text().strip()
-        return ""
-
-
-    # Extract body text using the enhanced function
-    body_text = extract_text(message['payload'])
+    body_text = extract_from_gmail_payload(message['payload'])
 
     return {
+        'id': message.get('id'),
+        'thread_id': message.get('threadId'),
         'sender': sender,
         'subject': subject,
         'body': body_text or "",
@@ -126,40 +358,113 @@ def get_full_email_details(service, message_id):
     }
 
 
-def get_body(payload):
-    """Recursively extract text content from all MIME types."""
-    # If 'parts' exists, process recursively
-    if 'parts' in payload:
-        # Prioritize text/plain but fallback to text/html
-        all_text = []
-        for part in payload['parts']:
-            text = extract_text(part)
-            if text:
-                all_text.append(text)
-        return "\n".join(all_text).strip()
-
-    # Handle single MIME type
-    mime_type = payload.get('mimeType', '')
-    body_data = payload.get('body', {}).get('data', '')
-
-    if body_data:
-        decoded_bytes = base64.urlsafe_b64decode(body_data.encode('UTF-8'))
-        decoded_text = decoded_bytes.decode('UTF-8', errors='ignore')
-
-        # Prioritize text/plain over text/html
-        if mime_type == 'text/plain':
-            return decoded_text.strip()
-        elif mime_type == 'text/html':
-            # Use BeautifulSoup to strip HTML tags
-            return BeautifulSoup(decoded_text, 'html.parser').get_text().strip()
-    return ""
-
-    # Extract body text using the enhanced function
-    body_text = extract_text(message['payload'])
+@span("fetch", source="gmail")
+def _fetch_batch(service, message_ids, fmt, max_retries, base_delay, sleep, metadata_headers=None):
+    """
+    Fetch one chunk of messages through a Gmail batch request, retrying 429/5xx items.
+    Returns (messages by id, ids that could not be fetched).
+    """
+    options = {'metadataHeaders': metadata_headers} if fmt == 'metadata' and metadata_headers else {}
+    messages = {}
+    errors = []
+    pending = list(message_ids)
+    for attempt in range(max_retries + 1):
+        failed = []
 
-    return {
-    'sender': sender,
-    'subject': subject,
-    'body': body_text or "No body found"
-    }
+        def callback(request_id, response, exception):
+            if exception is None:
+                messages[request_id] = response
+                # sizeEstimate is the whole message; this is what was actually downloaded
+                inc("bytes_fetched", len(json.dumps(response)), source="gmail", format=fmt)
+            elif http_status(exception) in RETRYABLE_STATUS:
+                failed.append(request_id)
+            elif http_status(exception) != 404:
+                # A 404 means the message was deleted, so there is nothing left to retry
+                print(f"Error fetching message {request_id}: {exception}")
+                errors.append(request_id)
+
+        batch = service.new_batch_http_request(callback=callback)
+        for message_id in pending:
+            batch.add(service.users().messages().get(userId='me', id=message_id, format=fmt, **options),
+                      request_id=message_id)
+        # Every call inside a batch is billed against the Gmail quota on its own
+        gmail_bucket().acquire(5 * len(pending))
+        try:
+            batch.execute()
+        except Exception as e:
+            # The whole batch call failed (e.g. 429 on the batch endpoint itself)
+            if http_status(e) not in RETRYABLE_STATUS:
+                raise
+            failed = [m for m in pending if m not in messages and m not in errors]
+            if retry_after(e) is not None:
+                gmail_bucket().penalize(retry_after(e))
+
+        pending = failed
+        if not pending:
+            break
+        inc("retries", len(pending), status="gmail_batch")
+        if attempt < max_retries:
+            sleep(backoff_delay(attempt, base_delay))
+    else:
+        print(f"Giving up on {len(pending)} messages after {max_retries} retries.")
+        errors.extend(pending)
+    return messages, errors
+
+
+def get_full_email_details_batch(service, message_ids, batch_size=GMAIL_BATCH_SIZE, max_workers=1,
+                                 max_retries=5, base_delay=1.0, service_factory=None, sleep=time.sleep):
+    """
+    Fetch many messages with Gmail batch requests. Returns (details, failed): the same dicts
+    as `get_full_email_details` in the order of `message_ids`, and the ids that could not be
+    fetched, so callers can leave their sync cursor before them.
 
+    `batch_size` bounds how many calls share one HTTP round trip. With `max_workers > 1`,
+    batches run on a thread pool; since discovery services are not thread-safe, each
+    worker then builds its own service through `service_factory()`.
+    """
+    message_ids = list(message_ids)
+    chunks = [message_ids[i:i + batch_size] for i in range(0, len(message_ids), batch_size)]
+    fetched = {}
+    failed = []
+
+    if max_workers > 1 and service_factory is not None:
+        local = threading.local()
+
+        def run(chunk):
+            if not hasattr(local, 'service'):
+                local.service = service_factory()
+            return _fetch_batch(local.service, chunk, 'full', max_retries, base_delay, sleep)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for messages, errors in pool.map(run, chunks):
+                fetched.update(messages)
+                failed.extend(errors)
+    else:
+        for chunk in chunks:
+            messages, errors = _fetch_batch(service, chunk, 'full', max_retries, base_delay, sleep)
+            fetched.update(messages)
+            failed.extend(errors)
+
+    return [parse_full_message(fetched[m]) for m in message_ids if m in fetched], failed
+
+
+def get_email_metadata_batch(service, message_ids, batch_size=GMAIL_BATCH_SIZE, max_retries=5, base_delay=1.0,
+                             sleep=time.sleep):
+    """
+    Headers and snippets for many messages via batched `format='metadata'` requests.
+    Returns (details in the order of `message_ids`, ids that could not be fetched).
+    """
+    message_ids = list(message_ids)
+    fetched = {}
+    failed = []
+    for start in range(0, len(message_ids), batch_size):
+        messages, errors = _fetch_batch(service, message_ids[start:start + batch_size], 'metadata', max_retries,
+                                        base_delay, sleep, metadata_headers=METADATA_HEADERS)
+        fetched.update(messages)
+        failed.extend(errors)
+    return [parse_metadata_message(fetched[m]) for m in message_ids if m in fetched], failed
+
+
+def get_body(payload):
+    """Extract the body text of a Gmail message payload."""
+    return extract_from_gmail_payload(payload)
@@ -0,0 +1,167 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+# Domains shared by many unrelated employers; a match on these says nothing about the job.
+GENERIC_DOMAINS = {
+    "gmail.com", "googlemail.com", "outlook.com", "hotmail.com", "yahoo.com", "icloud.com",
+    "greenhouse.io", "lever.co", "myworkday.com", "workday.com", "smartrecruiters.com",
+    "ashbyhq.com", "icims.com", "jobvite.com", "taleo.net", "successfactors.com",
+    "linkedin.com", "indeed.com", "hire.lever.co", "us.greenhouse-mail.io",
+}
+COMPANY_PATTERNS = [
+    re.compile(r"(?:applying|application|interest)\s+(?:to|at|with)\s+([A-Z][\w&.\- ]{1,40}?)(?:[,.!\n]| for | -|$)"),
+    re.compile(r"(?:position|role|job)\s+(?:at|with)\s+([A-Z][\w&.\- ]{1,40}?)(?:[,.!\n]| for | -|$)"),
+    re.compile(r"^([A-Z][\w&.\- ]{1,40}?)\s+(?:Careers|Recruiting|Talent|Hiring|Jobs)\b"),
+]
+STOPWORDS = {
+    "the", "a", "an", "and", "or", "to", "of", "for", "in", "on", "at", "with", "your", "you",
+    "we", "our", "is", "are", "be", "this", "that", "have", "has", "will", "from", "re", "fwd",
+    "thanks", "thank", "hi", "hello", "dear", "best", "regards", "team",
+}
+TOKEN_REGEX = re.compile(r"[a-z0-9]+")
+KEY_BONUS = {"thread": 1.0, "domain": 0.5, "company": 0.5}
+
+
+def sender_domain(sender):
+    """Return the lowercased domain of a 'Name <addr@domain>' sender, or ''."""
+    match = re.search(r"@([\w.-]+)", sender or "")
+    return match.group(1).lower().rstrip(".") if match else ""
+
+
+def company_name(sender, subject, body=""):
+    """Best-effort company name from the sender display name, subject or body."""
+    display = (sender or "").split("<")[0].strip().strip('"')
+    for text in (subject or "", body or "", display):
+        for pattern in COMPANY_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                return normalize_company(match.group(1))
+    domain = sender_domain(sender)
+    if domain and domain not in GENERIC_DOMAINS:
+        parts = domain.split(".")
+        return normalize_company(parts[-2] if len(parts) >= 2 else parts[0])
+    return ""
+
+
+def normalize_company(name):
+    name = re.sub(r"\b(inc|llc|ltd|corp|co|gmbh|team)\b\.?", "", name.lower())
+    return re.sub(r"[^a-z0-9]", "", name)
+
+
+def candidate_keys(sender, subject, snippet="", thread_id=None):
+    """Normalized keys that identify the job an email is about."""
+    keys = set()
+    if thread_id:
+        keys.add(("thread", thread_id))
+    domain = sender_domain(sender)
+    if domain and domain not in GENERIC_DOMAINS:
+        keys.add(("domain", domain))
+    company = company_name(sender, subject, snippet)
+    if company:
+        keys.add(("company", company))
+    return keys
+
+
+def tokenize(text):
+    return [t for t in TOKEN_REGEX.findall((text or "").lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+class JobIndex:
+    """
+    In-memory index over job rows: exact key lookups plus TF-IDF similarity on subject+snippet.
+    Rows are kept in an inverted index (term -> {position: weight}) with length-normalised
+    log-tf weights; IDF is applied on the query side so stored weights never go stale as rows
+    are added, and scoring only touches rows that share a term or key with the email.
+    """
+
+    def __init__(self, rows=()):
+        self.rows = []
+        self.positions = {}
+        self.vectors = []
+        self.row_keys = []
+        self.doc_freq = Counter()
+        self.postings = defaultdict(dict)
+        self.key_to_rows = defaultdict(set)
+        for row in rows:
+            self.add(row)
+
+    def add(self, row):
+        position = len(self.rows)
+        self.rows.append(row)
+        self.positions[id(row)] = position
+        self.vectors.append(Counter())
+        self.row_keys.append(set())
+        self._index_row(position)
+        return position
+
+    def update(self, row):
+        """Re-index a row whose subject, snippet, sender or thread id changed in place."""
+        position = self.positions.get(id(row))
+        if position is None:
+            return self.add(row)
+        self._unindex_row(position)
+        self._index_row(position)
+        return position
+
+    def _index_row(self, position):
+        row = self.rows[position]
+        terms = Counter(tokenize(f"{row.get('Subject', '')} {row.get('Body Snippet', '')}"))
+        self.vectors[position] = terms
+        self.doc_freq.update(terms.keys())
+        for term, weight in self._row_weights(terms).items():
+            self.postings[term][position] = weight
+        keys = candidate_keys(row.get("Sender", ""), row.get("Subject", ""), row.get("Body Snippet", ""),
+                              row.get("Thread ID"))
+        self.row_keys[position] = keys
+        for key in keys:
+            self.key_to_rows[key].add(position)
+
+    def _unindex_row(self, position):
+        for term in self.vectors[position]:
+            self.postings[term].pop(position, None)
+            if not self.postings[term]:
+                del self.postings[term]
+            self.doc_freq[term] -= 1
+            if self.doc_freq[term] <= 0:
+                del self.doc_freq[term]
+        for key in self.row_keys[position]:
+            self.key_to_rows[key].discard(position)
+
+    @staticmethod
+    def _row_weights(terms):
+        weights = {t: 1 + math.log(tf) for t, tf in terms.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {t: w / norm for t, w in weights.items()}
+
+    def _query_weights(self, terms):
+        total_docs = len(self.rows) + 1
+        weights = {t: (1 + math.log(tf)) * (math.log(total_docs / (1 + self.doc_freq.get(t, 0))) + 1e-3)
+                   for t, tf in terms.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {t: w / norm for t, w in weights.items()}
+
+    def similarity(self, query_terms, position):
+        query = self._query_weights(query_terms)
+        return sum(w * self.postings.get(t, {}).get(position, 0.0) for t, w in query.items())
+
+    def shortlist(self, email_doc, k=3, min_score=0.15):
+        """Return up to k (row, score) pairs most likely to be the same job as email_doc."""
+        if not self.rows:
+            return []
+        keys = candidate_keys(email_doc.get("sender", ""), email_doc.get("subject", ""),
+                              email_doc.get("snippet", ""), email_doc.get("thread_id"))
+        scores = defaultdict(float)
+        for key in keys:
+            for position in self.key_to_rows.get(key, ()):
+                scores[position] += KEY_BONUS[key[0]]
+
+        query_terms = Counter(tokenize(f"{email_doc.get('subject', '')} {email_doc.get('snippet', '')}"))
+        for term, weight in self._query_weights(query_terms).items():
+            for position, row_weight in self.postings.get(term, {}).items():
+                scores[position] += weight * row_weight
+
+        scored = [(score, position) for position, score in scores.items() if score >= min_score]
+        scored = heapq.nlargest(k, scored)
+        return [(self.rows[position], score) for score, position in scored]
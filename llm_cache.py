@@ -0,0 +1,103 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from metrics import inc
+
+LLM_CACHE_FILE = "llm_cache.sqlite3"
+LLM_CACHE_MAX_ENTRIES = 50000
+LLM_CACHE_TTL_SECONDS = 30 * 24 * 3600
+# Eviction scans the table, so it only runs every this many writes.
+EVICT_EVERY = 100
+
+
+def normalize_text(text):
+    """Collapse whitespace and case so trivially different copies of a template hash the same."""
+    return re.sub(r"\s+", " ", (text or "")).strip().casefold()
+
+
+def cache_key(namespace, model, prompt_version, *parts):
+    """Content-addressed key: namespace + model + prompt version + normalized inputs."""
+    digest = hashlib.sha256()
+    for part in (namespace, model, prompt_version, *map(normalize_text, parts)):
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class LLMCache:
+    """SQLite store of LLM answers with TTL and size-based (least recently used) eviction."""
+
+    def __init__(self, path=LLM_CACHE_FILE, max_entries=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        # WAL and a busy timeout let several worker processes share one cache file
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                inc("llm_cache_lookups", result="miss")
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        inc("llm_cache_lookups", result="hit")
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            self._conn.commit()
+            self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones beyond max_entries."""
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": size}
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """Process-wide cache shared by gpt_filter and the relevance checks."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = LLMCache()
+    return _default_cache
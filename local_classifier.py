@@ -0,0 +1,249 @@
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import zlib
+
+from helpers import compact_body, gpt_filter, gpt_filter_key
+from llm_cache import get_default_cache
+from metrics import inc
+
+LOCAL_MODEL_FILE = "local_classifier.json"
+LABEL_LOG_FILE = "llm_labels.jsonl"
+NUM_FEATURES = 2 ** 18
+BODY_CHARS = 3000
+CONFIDENCE_THRESHOLD = 0.9
+# Interview invites need the round extracted, which only the LLM does, so they always escalate.
+CONFIDENT_LABELS = {"No", "Applied", "Got Decision|Reject", "Got Decision|Success"}
+TOKEN_REGEX = re.compile(r"[a-z0-9']+")
+
+
+def verdict_label(verdict):
+    """Collapse a gpt_filter verdict into a single class label."""
+    if not verdict or verdict.get("job_related") != "Yes":
+        return "No"
+    category = verdict.get("category", "NA")
+    if category == "Got Decision":
+        return f"Got Decision|{verdict.get('decision', 'NA')}"
+    return category
+
+
+def label_verdict(label):
+    """Inverse of verdict_label, in gpt_filter's output format."""
+    if label == "No":
+        return {"job_related": "No", "category": "NA", "decision": "NA", "round": "NA"}
+    category, _, decision = label.partition("|")
+    return {"job_related": "Yes", "category": category, "decision": decision or "NA", "round": "NA"}
+
+
+def features(text):
+    """Hashed unigram + bigram counts of the start of `text`."""
+    tokens = TOKEN_REGEX.findall((text or "")[:BODY_CHARS].lower())
+    counts = {}
+    for gram in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+        index = zlib.crc32(gram.encode("utf-8")) % NUM_FEATURES
+        counts[index] = counts.get(index, 0) + 1
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {i: v / norm for i, v in counts.items()}
+
+
+class LocalClassifier:
+    """Multinomial logistic regression over hashed n-grams, stored as sparse per-class weights."""
+
+    def __init__(self, labels=(), weights=None, bias=None):
+        self.labels = list(labels)
+        self.weights = weights or {label: {} for label in self.labels}
+        self.bias = bias or {label: 0.0 for label in self.labels}
+
+    def probabilities(self, x):
+        scores = {label: self.bias[label] + sum(v * self.weights[label].get(i, 0.0) for i, v in x.items())
+                  for label in self.labels}
+        top = max(scores.values())
+        exps = {label: math.exp(s - top) for label, s in scores.items()}
+        total = sum(exps.values())
+        return {label: e / total for label, e in exps.items()}
+
+    def predict(self, text):
+        """Return (label, probability) for the most likely class."""
+        probs = self.probabilities(features(text))
+        label = max(probs, key=probs.get)
+        return label, probs[label]
+
+    def fit(self, examples, epochs=10, learning_rate=0.5, l2=1e-5, seed=0):
+        """SGD on (text, label) pairs."""
+        self.labels = sorted({label for _, label in examples})
+        self.weights = {label: {} for label in self.labels}
+        self.bias = {label: 0.0 for label in self.labels}
+        data = [(features(text), label) for text, label in examples]
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            rate = learning_rate / (1 + epoch)
+            for x, label in data:
+                probs = self.probabilities(x)
+                for cls in self.labels:
+                    gradient = probs[cls] - (1.0 if cls == label else 0.0)
+                    weights = self.weights[cls]
+                    for i, v in x.items():
+                        weights[i] = weights.get(i, 0.0) * (1 - rate * l2) - rate * gradient * v
+                    self.bias[cls] -= rate * gradient
+        return self
+
+    def save(self, path=LOCAL_MODEL_FILE):
+        weights = {label: {str(i): round(w, 6) for i, w in ws.items() if abs(w) > 1e-6}
+                   for label, ws in self.weights.items()}
+        with open(path, "w") as file:
+            json.dump({"labels": self.labels, "weights": weights, "bias": self.bias}, file)
+
+    @classmethod
+    def load(cls, path=LOCAL_MODEL_FILE):
+        with open(path, "r") as file:
+            data = json.load(file)
+        weights = {label: {int(i): w for i, w in ws.items()} for label, ws in data["weights"].items()}
+        return cls(data["labels"], weights, data["bias"])
+
+
+class TieredClassifier:
+    """
+    Drop-in replacement for gpt_filter: answers locally when the model is confident about an
+    easy class and escalates to gpt_filter otherwise. Fresh LLM verdicts (not cache hits) are
+    appended to the label log, once per body, as training data for the next `train` run.
+    `llm` is the escalation call, gpt_filter or a helpers.MicroBatchFilter.
+    """
+
+    def __init__(self, model=None, threshold=CONFIDENCE_THRESHOLD, label_log=LABEL_LOG_FILE, llm=gpt_filter):
+        self.model = model
+        self.llm = llm
+        self.threshold = threshold
+        self.label_log = label_log
+        self.local_hits = 0
+        self.escalations = 0
+        self._log_lock = threading.Lock()
+        self._logged = None
+
+    def __call__(self, body, client):
+        if self.model is not None:
+            label, probability = self.model.predict(body)
+            if label in CONFIDENT_LABELS and probability >= self.threshold:
+                self.local_hits += 1
+                inc("local_classifier", result="local")
+                return label_verdict(label)
+        self.escalations += 1
+        inc("local_classifier", result="escalated")
+        compacted = compact_body(body)
+        cache = get_default_cache()
+        verdict = cache.get(gpt_filter_key(compacted)) if compacted.strip() else None
+        if verdict is not None:
+            return verdict
+        verdict = self.llm(body=compacted, client=client, cache=cache, compacted=True, check_cache=False)
+        if verdict is not None and self.label_log:
+            self.log_label(body[:BODY_CHARS], verdict)
+        return verdict
+
+    def log_label(self, body, verdict):
+        """Append one labelled example unless the same body is already in the log."""
+        digest = body_hash(body)
+        with self._log_lock:
+            if self._logged is None:
+                self._logged = {body_hash(text) for text, _ in load_label_log(self.label_log)}
+            if digest in self._logged:
+                return
+            self._logged.add(digest)
+            with open(self.label_log, "a") as file:
+                file.write(json.dumps({"body": body, "verdict": verdict}) + "\n")
+
+
+def body_hash(body):
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+def tiered_classifier(path=LOCAL_MODEL_FILE, threshold=CONFIDENCE_THRESHOLD, llm=gpt_filter):
+    """TieredClassifier with the saved model, or LLM-only (still logging labels) if none exists."""
+    model = LocalClassifier.load(path) if os.path.exists(path) else None
+    return TieredClassifier(model, threshold, llm=llm)
+
+
+def load_label_log(path=LABEL_LOG_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    return [(r["body"], verdict_label(r["verdict"])) for r in records]
+
+
+def load_csv_examples(csv_file):
+    """Job rows from the tracker CSV; every row there was classified job-related."""
+    if not os.path.exists(csv_file):
+        return []
+    with open(csv_file, "r", newline="") as file:
+        rows = list(csv.DictReader(file))
+    return [(row["Body Snippet"], verdict_label({"job_related": "Yes", "category": row["Category"],
+                                                 "decision": row["Decision"]}))
+            for row in rows]
+
+
+def load_mongo_examples(collection):
+    """Saved documents from the filtered_emails collection."""
+    return [(doc.get("body", ""), verdict_label({"job_related": "Yes", **doc}))
+            for doc in collection.find({}, {"body": 1, "category": 1, "decision": 1})]
+
+
+def evaluate(model, examples, threshold=CONFIDENCE_THRESHOLD):
+    """Accuracy overall and on the confidently answered subset (which never reaches the LLM)."""
+    correct = confident = confident_correct = 0
+    for text, label in examples:
+        predicted, probability = model.predict(text)
+        correct += predicted == label
+        if predicted in CONFIDENT_LABELS and probability >= threshold:
+            confident += 1
+            confident_correct += predicted == label
+    total = len(examples) or 1
+    return {
+        "examples": len(examples),
+        "accuracy": correct / total,
+        "local_fraction": confident / total,
+        "local_accuracy": confident_correct / confident if confident else 0.0,
+    }
+
+
+def _collect_examples(args):
+    examples = load_label_log(args.labels) + load_csv_examples(args.csv)
+    if args.mongo:
+        from dotenv import load_dotenv
+        from persistence import get_collection
+        load_dotenv()
+        examples += load_mongo_examples(get_collection())
+    return examples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or evaluate the local email classifier.")
+    parser.add_argument("command", choices=["train", "eval"])
+    parser.add_argument("--labels", default=LABEL_LOG_FILE)
+    parser.add_argument("--csv", default="job_applications.csv")
+    parser.add_argument("--mongo", action="store_true", help="also use the filtered_emails collection")
+    parser.add_argument("--model", default=LOCAL_MODEL_FILE)
+    parser.add_argument("--threshold", type=float, default=CONFIDENCE_THRESHOLD)
+    parser.add_argument("--holdout", type=float, default=0.2)
+    args = parser.parse_args()
+
+    examples = _collect_examples(args)
+    if args.command == "train":
+        random.Random(0).shuffle(examples)
+        split = int(len(examples) * (1 - args.holdout))
+        model = LocalClassifier().fit(examples[:split])
+        print(json.dumps(evaluate(model, examples[split:], args.threshold), indent=2))
+        # Refit on everything for the saved model
+        LocalClassifier().fit(examples).save(args.model)
+        print(f"Saved model trained on {len(examples)} examples to {args.model}")
+    else:
+        print(json.dumps(evaluate(LocalClassifier.load(args.model), examples, args.threshold), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_PREFIX = "emailsorter"
+# Upper bounds (seconds) of the span latency histogram buckets
+SPAN_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+TRACEMALLOC_TOP = 20
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+
+class Metrics:
+    """Thread-safe counters and span latency histograms for one process."""
+
+    def __init__(self):
+        self.counters = {}
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            span = self.spans.get(key)
+            if span is None:
+                span = self.spans[key] = {"count": 0, "sum": 0.0, "buckets": [0] * len(SPAN_BUCKETS)}
+            span["count"] += 1
+            span["sum"] += seconds
+            for i, bound in enumerate(SPAN_BUCKETS):
+                if seconds <= bound:
+                    span["buckets"][i] += 1
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the enclosed block; failures are recorded with status="error"."""
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, status=status, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.spans.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "spans": [{"name": name, "labels": dict(labels), "count": span["count"],
+                           "seconds": round(span["sum"], 6)}
+                          for (name, labels), span in sorted(self.spans.items())],
+            }
+
+    def prometheus_text(self):
+        """Render everything in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f"{METRICS_PREFIX}_{name}_total{_format_labels(labels)} {value}")
+            if self.spans:
+                metric = f"{METRICS_PREFIX}_span_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+            for (name, labels), span in sorted(self.spans.items()):
+                labels = (("span", name),) + labels
+                for bound, count in zip(SPAN_BUCKETS, span["buckets"]):
+                    lines.append(f"{metric}_bucket{_format_labels(labels + (('le', str(bound)),))} {count}")
+                lines.append(f"{metric}_bucket{_format_labels(labels + (('le', '+Inf'),))} {span['count']}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {span['sum']:.6f}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {span['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Write atomically, as the node_exporter textfile collector expects."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def append_jsonl(self, path, **fields):
+        with open(path, "a") as file:
+            file.write(json.dumps({"time": time.time(), **fields, **self.snapshot()}) + "\n")
+
+
+metrics = Metrics()
+span = metrics.span
+inc = metrics.inc
+
+
+def record_completion(completion, purpose, model):
+    """Count one OpenAI call and the tokens its `usage` reports."""
+    inc("llm_requests", purpose=purpose, model=model)
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return
+    inc("llm_tokens", getattr(usage, "prompt_tokens", 0) or 0, kind="prompt", purpose=purpose, model=model)
+    inc("llm_tokens", getattr(usage, "completion_tokens", 0) or 0, kind="completion", purpose=purpose, model=model)
+
+
+@contextmanager
+def profiling(modes, output_prefix):
+    """Run the block under cProfile and/or tracemalloc, writing results next to `output_prefix`."""
+    modes = {mode.strip() for mode in modes.split(",") if mode.strip()}
+    profiler = None
+    if "cprofile" in modes:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if "tracemalloc" in modes:
+        import tracemalloc
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(f"{output_prefix}.pstats")
+            print(f"cProfile stats written to {output_prefix}.pstats")
+        if "tracemalloc" in modes:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(f"{output_prefix}.tracemalloc.txt", "w") as file:
+                file.write(f"current={current} peak={peak}\n")
+                for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+                    file.write(f"{stat}\n")
+            print(f"tracemalloc top allocations written to {output_prefix}.tracemalloc.txt")
+
+
+def default_metrics_dir():
+    """METRICS_DIR, looked up per run rather than at import time."""
+    return os.getenv("METRICS_DIR", "metrics")
+
+
+def default_profile():
+    """METRICS_PROFILE: "cprofile", "tracemalloc" or "cprofile,tracemalloc"; empty disables profiling."""
+    return os.getenv("METRICS_PROFILE", "")
+
+
+@contextmanager
+def instrumented_run(name, metrics_dir=None, profile=None):
+    """
+    Wrap one run of an entry point: times it as the "run" span, optionally profiles it, and
+    on exit writes `<dir>/<name>.prom` and appends a summary line to `<dir>/<name>.jsonl`.
+    """
+    metrics_dir = metrics_dir or default_metrics_dir()
+    profile = default_profile() if profile is None else profile
+    os.makedirs(metrics_dir, exist_ok=True)
+    prefix = os.path.join(metrics_dir, name)
+    status = "error"
+    try:
+        with profiling(profile, prefix), span("run", entry_point=name):
+            yield metrics
+        status = "ok"
+    finally:
+        metrics.write_textfile(f"{prefix}.prom")
+        metrics.append_jsonl(f"{prefix}.jsonl", entry_point=name, status=status)
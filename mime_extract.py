@@ -0,0 +1,149 @@
+import base64
+import codecs
+import html
+import quopri
+import re
+
+# Upper bound on body text handed to the prefilter and the LLM; decoding stops once it is reached.
+BODY_CHAR_BUDGET = 20000
+# Worst case UTF-8 expansion, used to size how many raw bytes to decode for a char budget.
+MAX_BYTES_PER_CHAR = 4
+
+DROP_BLOCKS = re.compile(r"<(script|style|head|title)\b[^>]*>.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+COMMENTS = re.compile(r"<!--.*?-->", re.DOTALL)
+BLOCK_BREAKS = re.compile(r"<\s*(?:br|/p|/div|/tr|/li|/h[1-6]|p|div|tr|li)\b[^>]*>", re.IGNORECASE)
+TAGS = re.compile(r"<[^>]+>")
+SPACES = re.compile(r"[ \t\r\f\v\xa0]+")
+BLANK_LINES = re.compile(r"\n\s*\n+")
+CHARSET = re.compile(r"charset\s*=\s*\"?([\w.:-]+)", re.IGNORECASE)
+
+
+def html_to_text(markup):
+    """Cheap regex HTML stripper: drops scripts/styles/comments, keeps block breaks, unescapes entities."""
+    markup = COMMENTS.sub("", DROP_BLOCKS.sub("", markup))
+    text = html.unescape(TAGS.sub("", BLOCK_BREAKS.sub("\n", markup)))
+    text = SPACES.sub(" ", text)
+    return BLANK_LINES.sub("\n\n", "\n".join(line.strip() for line in text.split("\n"))).strip()
+
+
+def decode_bytes(data, charset):
+    """Decode with the declared charset, falling back to UTF-8 with replacement for unknown or bad ones."""
+    try:
+        codecs.lookup(charset or "utf-8")
+    except LookupError:
+        charset = "utf-8"
+    return data.decode(charset or "utf-8", errors="replace")
+
+
+def _b64_prefix(data, max_bytes):
+    """Decode at most ~max_bytes from Gmail's unpadded urlsafe base64 string."""
+    data = data[:((max_bytes + 2) // 3) * 4]
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _part_prefix(part, max_bytes):
+    """
+    Decode at most ~max_bytes of an email.message part. Base64 and quoted-printable bodies are
+    cut before decoding, so a huge part costs no more than the budget; other encodings are
+    already plain bytes.
+    """
+    encoding = (part.get("Content-Transfer-Encoding") or "").strip().lower()
+    raw = part.get_payload()
+    if not isinstance(raw, str) or encoding not in ("base64", "quoted-printable"):
+        return (part.get_payload(decode=True) or b"")[:max_bytes]
+    if encoding == "base64":
+        needed = ((max_bytes + 2) // 3) * 4
+        # Line breaks do not count towards the needed characters, so allow for them
+        data = "".join(raw[:needed + needed // 16 + 4].split())[:needed]
+        try:
+            return base64.b64decode(data[:len(data) - len(data) % 4])[:max_bytes]
+        except ValueError:
+            return (part.get_payload(decode=True) or b"")[:max_bytes]
+    # Quoted-printable spends at most 3 characters per byte, plus soft line breaks
+    data = raw[:max_bytes * 3 + max_bytes // 4 + 4]
+    if len(data) < len(raw):
+        # Do not decode an escape or soft line break cut in half
+        cut = data.rfind("=", max(0, len(data) - 3))
+        if cut != -1:
+            data = data[:cut]
+    try:
+        data = data.encode("ascii", errors="surrogateescape")
+    except UnicodeEncodeError:
+        data = data.encode("raw-unicode-escape")
+    return quopri.decodestring(data)[:max_bytes]
+
+
+def _finish(pieces, max_chars):
+    text = "\n".join(p for p in pieces if p).strip()
+    return text[:max_chars]
+
+
+def _is_attachment(disposition, filename):
+    return bool(filename) or (disposition or "").strip().lower().startswith("attachment")
+
+
+def _gmail_header(part, name):
+    for header in part.get("headers", []):
+        if header["name"].lower() == name:
+            return header["value"]
+    return ""
+
+
+def _walk_gmail(payload):
+    yield payload
+    for part in payload.get("parts", []):
+        yield from _walk_gmail(part)
+
+
+def extract_from_gmail_payload(payload, max_chars=BODY_CHAR_BUDGET):
+    """
+    Body text of a Gmail `format='full'` payload. text/plain parts win; HTML parts are only
+    decoded and stripped when there is no plain text. Attachments are never decoded.
+    """
+    plain, markup = [], []
+    for part in _walk_gmail(payload):
+        mime_type = part.get("mimeType", "")
+        data = part.get("body", {}).get("data")
+        if not data or mime_type not in ("text/plain", "text/html"):
+            continue
+        if _is_attachment(_gmail_header(part, "content-disposition"), part.get("filename")):
+            continue
+        (plain if mime_type == "text/plain" else markup).append(part)
+
+    remaining = max_chars
+    pieces = []
+    for part in plain or markup:
+        if remaining <= 0:
+            break
+        match = CHARSET.search(_gmail_header(part, "content-type"))
+        text = decode_bytes(_b64_prefix(part["body"]["data"], remaining * MAX_BYTES_PER_CHAR),
+                            match.group(1) if match else "utf-8")
+        text = text.strip() if plain else html_to_text(text)
+        pieces.append(text)
+        remaining -= len(text)
+    return _finish(pieces, max_chars)
+
+
+def extract_from_message(msg, max_chars=BODY_CHAR_BUDGET):
+    """Same as extract_from_gmail_payload, for an `email.message.Message` (IMAP/RFC822)."""
+    plain, markup = [], []
+    for part in msg.walk():
+        if part.is_multipart():
+            continue
+        content_type = part.get_content_type()
+        if content_type not in ("text/plain", "text/html"):
+            continue
+        if _is_attachment(part.get("Content-Disposition"), part.get_filename()):
+            continue
+        (plain if content_type == "text/plain" else markup).append(part)
+
+    remaining = max_chars
+    pieces = []
+    for part in plain or markup:
+        if remaining <= 0:
+            break
+        text = decode_bytes(_part_prefix(part, remaining * MAX_BYTES_PER_CHAR), part.get_content_charset())
+        text = text.strip() if plain else html_to_text(text)
+        pieces.append(text)
+        remaining -= len(text)
+    return _finish(pieces, max_chars)
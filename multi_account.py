@@ -0,0 +1,177 @@
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.managers import SyncManager
+
+from dotenv import load_dotenv
+
+from metrics import instrumented_run, metrics
+from ratelimit import SharedBucket, TokenBucket, openai_limits, shared_openai_client
+from sync_state import SYNC_STATE_FILE, SyncState
+
+load_dotenv()
+
+ACCOUNTS_FILE = "accounts.json"
+ACCOUNTS_DIR = "accounts"
+ACCOUNT_WORKERS = os.cpu_count() or 4
+SINK_QUEUE_SIZE = 1000
+
+
+class LimiterManager(SyncManager):
+    """Hosts the OpenAI rate limit buckets that every worker process draws from."""
+
+
+LimiterManager.register("TokenBucket", TokenBucket)
+
+
+def load_accounts(path=ACCOUNTS_FILE):
+    """
+    Read the accounts file: {"accounts": [{"name": ..., "type": "gmail" | "imap", ...}]}.
+    Gmail accounts take `token_file` and `credentials_file`; IMAP accounts take `email`,
+    `server` and `password_env` (the environment variable holding the password). Each
+    account keeps its tracker CSV, job database and sync state under `data_dir`.
+    """
+    with open(path, "r") as file:
+        accounts = json.load(file)["accounts"]
+    names = [account["name"] for account in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate account names in {path}")
+    for account in accounts:
+        if account.get("type") not in ("gmail", "imap"):
+            raise ValueError(f"Account {account['name']!r} needs a type of 'gmail' or 'imap'")
+        account.setdefault("data_dir", os.path.join(ACCOUNTS_DIR, account["name"]))
+    return accounts
+
+
+class QueueSink:
+    """Stands in for a MongoSink inside a worker: docs are sent to the runner's single sink."""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def add(self, email_doc):
+        self.queue.put(email_doc)
+
+
+def drain_to_sink(queue, sink):
+    """
+    Runner-side loop moving docs from `queue` into `sink` until a None arrives. A failed
+    flush is only reported: the sink keeps the docs buffered for its next flush, and the
+    loop must keep draining or workers would block on a full queue.
+    """
+    while True:
+        email_doc = queue.get()
+        if email_doc is None:
+            return
+        try:
+            sink.add(email_doc)
+        except Exception as e:
+            print(f"Error flushing to MongoDB: {e}")
+
+
+def _init_worker(requests_proxy, tokens_proxy):
+    shared_openai_client(requests=SharedBucket(requests_proxy), tokens=SharedBucket(tokens_proxy))
+
+
+def sync_account(account, queue):
+    """Sync one account with its own credentials, connection and sync state; runs in a worker."""
+    from local_classifier import tiered_classifier
+    from pipeline import email_stages
+    from prefilter import default_prefilter
+    from storage import get_store
+
+    password = None
+    if account["type"] == "imap":
+        password_env = account.get("password_env", "EMAIL_PASSWORD")
+        password = os.getenv(password_env)
+        if not password:
+            # connect_imap would otherwise fall back to the default account's password
+            raise ValueError(f"Account {account['name']!r}: ${password_env} is not set")
+
+    data_dir = account["data_dir"]
+    os.makedirs(data_dir, exist_ok=True)
+    csv_file = os.path.join(data_dir, "job_applications.csv")
+    state = SyncState(os.path.join(data_dir, SYNC_STATE_FILE))
+    metrics.reset()
+    started = time.perf_counter()
+    with instrumented_run(f"account_{account['name']}"):
+        stages = email_stages(shared_openai_client(), QueueSink(queue), csv_file, classifier=tiered_classifier())
+        if account["type"] == "gmail":
+            from fetch_emails import authenticate_gmail, sync_gmail
+            service = authenticate_gmail(account.get("token_file", os.path.join(data_dir, "token.json")),
+                                         account.get("credentials_file", "credentials.json"))
+            handled = sync_gmail(service, state, stages, prefilter=default_prefilter(), csv_file=csv_file)
+        else:
+            from fetchemails_via_imap import IMAP_SERVER, connect_imap, imap_source, sync_imap
+            mail = connect_imap(account.get("server", IMAP_SERVER), account["email"], password)
+            try:
+                handled = sync_imap(mail, state, stages, source=imap_source(account["email"]),
+                                    prefilter=default_prefilter(), csv_file=csv_file)
+            finally:
+                mail.logout()
+        get_store(csv_file).export_csv(csv_file)
+    return {"account": account["name"], "messages": handled, "seconds": time.perf_counter() - started}
+
+
+def run_accounts(accounts, workers=ACCOUNT_WORKERS):
+    """
+    Sync every account on a pool of `workers` processes (accounts beyond that queue up), with
+    one OpenAI budget and one MongoDB sink shared by all of them. Returns per-account results.
+    """
+    from persistence import MongoSink, get_collection
+
+    results = []
+    started = time.perf_counter()
+    with LimiterManager() as manager:
+        rpm, tpm = openai_limits()
+        requests = manager.TokenBucket(rpm / 60.0, max(1.0, rpm / 60.0))
+        tokens = manager.TokenBucket(tpm / 60.0, tpm / 6.0)
+        queue = manager.Queue(maxsize=SINK_QUEUE_SIZE)
+        with MongoSink(get_collection()) as sink:
+            drainer = threading.Thread(target=drain_to_sink, args=(queue, sink), daemon=True)
+            drainer.start()
+            try:
+                # Spawned (not forked) workers start without the runner's Mongo client and threads
+                with ProcessPoolExecutor(max_workers=min(workers, len(accounts)) or 1,
+                                         mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_init_worker, initargs=(requests, tokens)) as pool:
+                    futures = {pool.submit(sync_account, account, queue): account["name"] for account in accounts}
+                    for future in as_completed(futures):
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            print(f"{futures[future]}: failed: {e!r}")
+                            continue
+                        print(f"{result['account']}: {result['messages']} messages in {result['seconds']:.1f}s")
+                        results.append(result)
+            finally:
+                queue.put(None)
+                drainer.join()
+
+    elapsed = time.perf_counter() - started
+    total = sum(result["messages"] for result in results)
+    rate = total / elapsed if elapsed else 0.0
+    print(f"{len(results)}/{len(accounts)} accounts synced: {total} messages in {elapsed:.1f}s ({rate:.1f} msgs/s)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync several mailboxes in parallel worker processes.")
+    parser.add_argument("--accounts", default=ACCOUNTS_FILE)
+    parser.add_argument("--workers", type=int, default=ACCOUNT_WORKERS)
+    parser.add_argument("--only", nargs="+", default=None, help="account names to sync (default: all)")
+    args = parser.parse_args()
+
+    accounts = load_accounts(args.accounts)
+    if args.only:
+        accounts = [account for account in accounts if account["name"] in args.only]
+    with instrumented_run("multi_account"):
+        run_accounts(accounts, args.workers)
+
+
+if __name__ == "__main__":
+    main()
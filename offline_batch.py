@@ -0,0 +1,43 @@
+import argparse
+import json
+
+from helpers import MAX_TOKENS_PER_BATCH, read_batch_jsonl, write_batch_jsonl
+
+
+def load_bodies(path):
+    """Email bodies from a JSONL file with one {"body": ...} object per line (e.g. llm_labels.jsonl)."""
+    with open(path, "r") as file:
+        return [json.loads(line).get("body", "") for line in file if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Classify a large set of emails through the OpenAI Batch API instead of online calls.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    write = subparsers.add_parser("write", help="write a Batch API input file for the emails")
+    write.add_argument("emails", help="JSONL file with one {\"body\": ...} object per line")
+    write.add_argument("requests", help="Batch API input file to create")
+    write.add_argument("--max-tokens", type=int, default=MAX_TOKENS_PER_BATCH)
+    read = subparsers.add_parser("read", help="cache the verdicts from a Batch API output file")
+    read.add_argument("emails", help="the same emails file that was passed to `write`")
+    read.add_argument("results", help="Batch API output file")
+    read.add_argument("--out", default=None, help="also write {\"body\", \"verdict\"} lines here")
+    args = parser.parse_args()
+
+    bodies = load_bodies(args.emails)
+    if args.command == "write":
+        write_batch_jsonl(bodies, args.requests, args.max_tokens)
+        print(f"Wrote batch requests for {len(bodies)} emails to {args.requests}")
+        return
+
+    verdicts = read_batch_jsonl(args.results, bodies)
+    answered = sum(verdict is not None for verdict in verdicts)
+    print(f"Cached {answered} of {len(bodies)} verdicts; {len(bodies) - answered} will be classified online.")
+    if args.out:
+        with open(args.out, "w") as file:
+            for body, verdict in zip(bodies, verdicts):
+                file.write(json.dumps({"body": body, "verdict": verdict}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import threading
+
+from metrics import inc, span
+
+MONGO_FLUSH_SIZE = 100
+MONGO_FLUSH_INTERVAL = 5.0
+MONGO_MAX_POOL_SIZE = 20
+
+_client = None
+_client_lock = threading.Lock()
+# pymongo names, imported on first use so entry points that never write to Mongo skip it
+ASCENDING = MongoClient = UpdateOne = None
+
+
+def mongo_uri():
+    db_password = os.getenv("DB_PASSWORD")
+    return os.getenv("URI").replace("<db_password>", db_password)
+
+
+def load_pymongo():
+    global ASCENDING, MongoClient, UpdateOne
+    if MongoClient is None:
+        from pymongo import ASCENDING, MongoClient, UpdateOne
+
+
+def get_mongo_client():
+    """One pooled MongoClient per process (MongoClient is thread-safe and pools connections)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            load_pymongo()
+            _client = MongoClient(mongo_uri(), maxPoolSize=MONGO_MAX_POOL_SIZE)
+        return _client
+
+
+def get_collection():
+    return get_mongo_client().email_app.filtered_emails
+
+
+def doc_key(email_doc):
+    """Stable idempotency key: Gmail message id, else Message-ID header, else a content hash."""
+    if email_doc.get("id"):
+        return f"gmail:{email_doc['id']}"
+    if email_doc.get("message_id"):
+        return f"msgid:{email_doc['message_id']}"
+    digest = hashlib.sha256(
+        "\x00".join(str(email_doc.get(f, "")) for f in ("sender", "subject", "body")).encode("utf-8")
+    ).hexdigest()
+    return f"sha256:{digest}"
+
+
+class MongoSink:
+    """
+    Buffers email docs and writes them with one unordered bulk_write of upserts keyed on
+    `message_key`, so reruns update instead of duplicating. Flushes when `flush_size` docs are
+    buffered, every `flush_interval` seconds from a background thread, and on close().
+    """
+
+    def __init__(self, collection, flush_size=MONGO_FLUSH_SIZE, flush_interval=MONGO_FLUSH_INTERVAL):
+        self.collection = collection
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # The sink may be handed a collection that did not come from get_mongo_client
+        load_pymongo()
+        self.ensure_indexes()
+        self._thread = None
+        if flush_interval:
+            self._thread = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._thread.start()
+
+    def ensure_indexes(self):
+        # Documents written before idempotent upserts have no message_key; leaving them out of
+        # the index keeps their missing keys from colliding as duplicate nulls
+        self.collection.create_index([("message_key", ASCENDING)], unique=True,
+                                     partialFilterExpression={"message_key": {"$exists": True}})
+        self.collection.create_index([("sender", ASCENDING), ("subject", ASCENDING)])
+
+    def add(self, email_doc):
+        key = doc_key(email_doc)
+        doc = {k: v for k, v in email_doc.items() if k != "_id"}
+        doc["message_key"] = key
+        with self._lock:
+            self._buffer.append(UpdateOne({"message_key": key}, {"$set": doc}, upsert=True))
+            full = len(self._buffer) >= self.flush_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            operations, self._buffer = self._buffer, []
+        if not operations:
+            return
+        try:
+            with span("mongo_flush"):
+                self.collection.bulk_write(operations, ordered=False)
+        except Exception:
+            # Upserts are idempotent, so the whole chunk can simply be retried on the next flush
+            with self._lock:
+                self._buffer = operations + self._buffer
+            raise
+        self.written += len(operations)
+        inc("mongo_documents_written", len(operations))
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing to MongoDB: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
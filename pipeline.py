@@ -0,0 +1,251 @@
+import asyncio
+import time
+
+from helpers import gpt_filter, get_email_metadata_batch, get_full_email_details_batch, GMAIL_BATCH_SIZE
+from metrics import inc, span
+from save_to_db import update_or_add_job
+from storage import get_store
+
+# Source identifiers carried from the fetched message onto the saved document.
+ID_FIELDS = ("id", "uid", "thread_id", "message_id")
+
+# Default per-stage worker counts. Store writes are serialised by the store's transaction
+# lock, but persistence stays at 1 so each email is matched against every row saved before
+# it: apply_email only re-checks thread and exact matches, so two concurrent emails about
+# the same new job could otherwise both miss in the LLM relevance check and add two rows.
+STAGE_CONCURRENCY = {"prefilter": 1, "classify": 8, "persist": 1}
+QUEUE_SIZE = 64
+
+_DONE = object()
+
+
+class FetchFailed(dict):
+    """Yielded by a producer for an item it could not fetch; counted as failed, never processed."""
+
+
+class StageStats:
+    """
+    Items handled and time spent by one pipeline stage. `latencies` holds the end-to-end time
+    (from leaving the producer, queueing included) of each item whose run ended at this stage,
+    whether it was dropped, failed or came out of the last stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items_in = 0
+        self.items_out = 0
+        self.failed = []
+        self.latencies = []
+        self.busy_seconds = 0.0
+        self.first_start = None
+        self.last_end = None
+
+    def record(self, started, ended, passed):
+        self.items_in += 1
+        self.items_out += int(passed)
+        self.busy_seconds += ended - started
+        self.first_start = started if self.first_start is None else min(self.first_start, started)
+        self.last_end = ended if self.last_end is None else max(self.last_end, ended)
+
+    def throughput(self):
+        elapsed = (self.last_end - self.first_start) if self.first_start is not None else 0.0
+        return self.items_in / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return (f"{self.name:<10} in={self.items_in:<5} out={self.items_out:<5} failed={len(self.failed):<4} "
+                f"{self.throughput():8.2f} items/s  busy={self.busy_seconds:.2f}s")
+
+
+async def _produce(producer, outq, downstream_workers, stats):
+    """Drain a blocking producer iterable on a thread, blocking it whenever `outq` is full."""
+    loop = asyncio.get_running_loop()
+
+    def drain():
+        iterator = iter(producer)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            if isinstance(item, FetchFailed):
+                stats.failed.append(item)
+                stats.record(started, time.perf_counter(), False)
+                continue
+            ended = time.perf_counter()
+            stats.record(started, ended, True)
+            asyncio.run_coroutine_threadsafe(outq.put((ended, item)), loop).result()
+
+    try:
+        await asyncio.to_thread(drain)
+    finally:
+        for _ in range(downstream_workers):
+            await outq.put(_DONE)
+
+
+async def _stage(func, inq, outq, workers, downstream_workers, stats):
+    """
+    Run `func` on items from `inq` with `workers` concurrent calls. None results are dropped;
+    items whose call raised are reported and kept in `stats.failed` instead of stopping the run.
+    """
+
+    async def worker():
+        while True:
+            entry = await inq.get()
+            if entry is _DONE:
+                return
+            entered, item = entry
+            started = time.perf_counter()
+            try:
+                result = await asyncio.to_thread(func, item)
+            except Exception as e:
+                print(f"Error in {stats.name} stage: {e}")
+                stats.failed.append(item)
+                result = None
+            ended = time.perf_counter()
+            stats.record(started, ended, result is not None)
+            if result is not None and outq is not None:
+                await outq.put((entered, result))
+            else:
+                stats.latencies.append(ended - entered)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(workers)))
+    finally:
+        if outq is not None:
+            for _ in range(downstream_workers):
+                await outq.put(_DONE)
+
+
+async def run_pipeline_async(producer, stages, concurrency=None, queue_size=QUEUE_SIZE):
+    """
+    Push items from `producer` (any iterable of email dicts) through `stages`, a list of
+    (name, func) pairs. Stages are connected by bounded queues, so a slow stage applies
+    backpressure upstream. Returns one StageStats per stage, producer first.
+    """
+    concurrency = {**STAGE_CONCURRENCY, **(concurrency or {})}
+    workers = [concurrency.get(name, 1) for name, _ in stages]
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    stats = [StageStats("fetch")] + [StageStats(name) for name, _ in stages]
+
+    tasks = [_produce(producer, queues[0], workers[0], stats[0])]
+    for i, (name, func) in enumerate(stages):
+        outq = queues[i + 1] if i + 1 < len(stages) else None
+        downstream = workers[i + 1] if i + 1 < len(stages) else 0
+        tasks.append(_stage(func, queues[i], outq, workers[i], downstream, stats[i + 1]))
+    await asyncio.gather(*tasks)
+    return stats
+
+
+def failed_items(stats):
+    """All items that could not be fetched or raised in any stage of a finished run."""
+    return [item for stage in stats for item in stage.failed]
+
+
+def run_pipeline(producer, stages, concurrency=None, queue_size=QUEUE_SIZE):
+    """Blocking wrapper around run_pipeline_async that prints per-stage throughput."""
+    started = time.perf_counter()
+    stats = asyncio.run(run_pipeline_async(producer, stages, concurrency, queue_size))
+    elapsed = time.perf_counter() - started
+    print(f"Pipeline finished in {elapsed:.2f}s")
+    for stage in stats:
+        print(f"  {stage}")
+    return stats
+
+
+def gmail_producer(service, messages, batch_size=GMAIL_BATCH_SIZE, prefilter=None, is_tracked=None):
+    """
+    Yield full email dicts for Gmail `messages`, one batch request at a time.
+
+    With a `prefilter`, each batch is first fetched as metadata only (From, Subject, snippet)
+    and scored with `prefilter(sender, subject, snippet)`; full bodies are then fetched only for
+    survivors and for replies in threads where `is_tracked(thread_id)` is true.
+    Messages that could not be fetched are yielded as FetchFailed({"id": ...}).
+    """
+    message_ids = [msg['id'] for msg in messages]
+    for start in range(0, len(message_ids), batch_size):
+        chunk = message_ids[start:start + batch_size]
+        if prefilter is not None:
+            survivors = []
+            metadata, failed = get_email_metadata_batch(service, chunk, batch_size=batch_size)
+            for message_id in failed:
+                yield FetchFailed(id=message_id)
+            for details in metadata:
+                with span("prefilter"):
+                    keep = prefilter(details["sender"], details["subject"], details["snippet"])
+                keep = keep or (is_tracked is not None and is_tracked(details["thread_id"]))
+                inc("prefilter_results", result="pass" if keep else "drop")
+                if keep:
+                    survivors.append(details["id"])
+            chunk = survivors
+        if chunk:
+            details, failed = get_full_email_details_batch(service, chunk, batch_size=batch_size)
+            for message_id in failed:
+                yield FetchFailed(id=message_id)
+            yield from details
+
+
+def imap_producer(fetch, mail, uids=None, chunk_size=GMAIL_BATCH_SIZE, **kwargs):
+    """
+    Yield email dicts from an IMAP fetch function such as fetch_emails_imap_pipelined,
+    `chunk_size` UIDs at a time so classification starts before the whole fetch is done.
+    """
+    if uids is None:
+        yield from fetch(mail=mail, **kwargs)
+        return
+    uids = sorted(uids, reverse=True)
+    for start in range(0, len(uids), chunk_size):
+        yield from fetch(mail=mail, uids=uids[start:start + chunk_size], **kwargs)
+
+
+def email_stages(openaiclient, sink, csv_file, prefilter=None, classifier=None):
+    """
+    The standard prefilter -> classify -> persist stages shared by both entry points.
+    `classifier(body, client)` defaults to gpt_filter; pass a TieredClassifier to answer
+    easy emails locally. Saved docs go to `sink.add`, e.g. a persistence.MongoSink.
+    Replies in a thread that is already tracked are kept even when they look unrelated on
+    their own, so the job row follows the whole conversation.
+    """
+    classifier = classifier or gpt_filter
+
+    def prefilter_stage(email_data):
+        if prefilter is None:
+            return email_data
+        with span("prefilter"):
+            filter_result = prefilter(email_data["sender"], email_data["subject"], email_data.get("body", ""))
+        if not filter_result and get_store(csv_file).find_thread(email_data.get("thread_id")) is not None:
+            filter_result = "tracked thread"
+        inc("prefilter_results", result="pass" if filter_result else "drop")
+        if not filter_result:
+            return None
+        print(f" {email_data['sender']} | {email_data['subject']} | Filter: {filter_result}")
+        return email_data
+
+    def classify_stage(email_data):
+        with span("classify"):
+            filtered_info = classifier(body=email_data["body"], client=openaiclient)
+        if not filtered_info or filtered_info.get('job_related') != 'Yes':
+            if get_store(csv_file).find_thread(email_data.get("thread_id")) is None:
+                inc("classifications", category="not_job")
+                return None
+            filtered_info = {"category": "NA"}
+        inc("classifications", category=filtered_info.get('category', "NA"))
+        return {
+            **{field: email_data[field] for field in ID_FIELDS if email_data.get(field)},
+            "sender": email_data["sender"],
+            "subject": email_data["subject"],
+            "body": email_data["body"],
+            "snippet": email_data["snippet"],
+            "category": filtered_info.get('category', "NA"),
+            "decision": filtered_info.get('decision', "NA"),
+            "round": filtered_info.get('round', "NA"),
+        }
+
+    def persist_stage(email_doc):
+        with span("persist"):
+            update_or_add_job(csv_file, email_doc)
+            sink.add(email_doc)
+        print(f"Saved: {email_doc['sender']} | {email_doc['subject']}")
+        return email_doc
+
+    return [("prefilter", prefilter_stage), ("classify", classify_stage), ("persist", persist_stage)]
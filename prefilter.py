@@ -0,0 +1,165 @@
+import json
+import os
+import re
+import sys
+
+# Bytes of the body inspected by the prefilter; job signals are almost always near the top.
+BODY_SCAN_CHARS = 2000
+PREFILTER_THRESHOLD = 2.0
+
+ATS_DOMAINS = (
+    "greenhouse.io", "greenhouse-mail.io", "lever.co", "myworkday.com", "workday.com",
+    "smartrecruiters.com", "ashbyhq.com", "icims.com", "jobvite.com", "taleo.net",
+    "successfactors.com", "workablemail.com", "recruitee.com", "bamboohr.com",
+)
+
+# Scored on the parsed sender domain rather than in the sender regex, whose non-overlapping
+# matches would let `no_reply` consume the "@" this needs.
+ATS_DOMAIN_WEIGHT = 3.0
+
+# (feature name, weight, pattern). Each field gets one combined regex built from its features.
+SENDER_FEATURES = [
+    ("sender_keyword", 2.0, r"recruit\w*|careers?|hiring|talent|jobs?|\bhr\b|people(?:ops)?|@company\.com"),
+    ("sender_job_title", 1.0, r"application|interview|offer|hire"),
+    ("no_reply", 0.5, r"^(?:no-?reply|donotreply|noreply)[\w.-]*@"),
+]
+SUBJECT_FEATURES = [
+    ("subject_application", 2.0, r"\bapplication\b|\bapplied\b|\bapplying\b|\bcandidacy\b|\bcandidate\b"),
+    ("subject_interview", 2.5, r"\binterview\w*|\bphone screen\b|\bcoding (?:challenge|test)|\bassessment\b|\bonsite\b"),
+    ("subject_outcome", 2.0, r"\boffer\b|\bnext steps?\b|\bupdate on your\b|\bregret\b|\bposition\b|\brole\b"),
+    ("subject_promo", -2.5, r"\bnewsletter\b|\bsale\b|\b\d+% off\b|\bdeal\b|\breceipt\b|\border\b|\bwebinar\b|\bdigest\b"),
+    ("subject_job_alert", -1.5, r"\bjob alert\b|\bjobs? (?:for you|you may like)\b|\brecommended jobs\b"),
+]
+BODY_FEATURES = [
+    ("body_application", 1.5, r"thank(?:s| you) for (?:applying|your (?:application|interest))|received your application"),
+    ("body_interview", 1.5, r"\binterview\b|\bschedule a (?:call|time)\b|\bcalendly\.com\b|\bavailability\b"),
+    ("body_outcome", 1.5, r"\bwe regret\b|\bunfortunately\b|\bnot (?:be )?moving forward\b|\bpleased to offer\b|\boffer letter\b"),
+    ("body_recruiting", 0.5, r"\brecruit(?:er|ing)\b|\bhiring (?:team|manager)\b|\bthe position\b|\bthe role\b"),
+    ("body_unsubscribe", -1.0, r"\bunsubscribe\b|\bview (?:this email )?in (?:your )?browser\b"),
+]
+ANGLE_ADDRESS = re.compile(r"<(.*?)>")
+
+
+def _combine(features):
+    """Compile features into one alternation so a field is scanned in a single pass."""
+    pattern = "|".join(f"(?P<{name}>{regex})" for name, regex in ((n, r) for n, _, r in features))
+    return re.compile(pattern, re.IGNORECASE), {name: weight for name, weight, _ in features}
+
+
+def _domain_list(value):
+    return tuple(d.strip().lower().lstrip("@") for d in (value or "").split(",") if d.strip())
+
+
+def sender_address(sender):
+    """Extract the address from "Name <email>"."""
+    match = ANGLE_ADDRESS.search(sender or "")
+    return (match.group(1) if match else (sender or "")).strip().lower()
+
+
+class Prefilter:
+    """
+    Weighted keyword scorer over sender, subject and the start of the body.
+
+    Calling an instance returns a short reason string when the score reaches `threshold`
+    (or the sender domain is allow-listed) and None otherwise, matching the old filter_email.
+    """
+
+    def __init__(self, threshold=PREFILTER_THRESHOLD, allow_domains=(), deny_domains=(),
+                 body_chars=BODY_SCAN_CHARS):
+        self.threshold = threshold
+        self.allow_domains = tuple(allow_domains)
+        self.deny_domains = tuple(deny_domains)
+        self.body_chars = body_chars
+        self.sender_regex, self.sender_weights = _combine(SENDER_FEATURES)
+        self.subject_regex, self.subject_weights = _combine(SUBJECT_FEATURES)
+        self.body_regex, self.body_weights = _combine(BODY_FEATURES)
+
+    @staticmethod
+    def _domain_matches(domain, domains):
+        return any(domain == d or domain.endswith("." + d) for d in domains)
+
+    def _score_field(self, regex, weights, text, reasons):
+        score = 0.0
+        seen = set()
+        for match in regex.finditer(text):
+            name = match.lastgroup
+            if name not in seen:
+                seen.add(name)
+                score += weights[name]
+                reasons.append(name)
+        return score
+
+    def score(self, sender, subject, body=""):
+        """Return (score, reasons); allow/deny-listed domains score +/- infinity."""
+        address = sender_address(sender)
+        domain = address.rsplit("@", 1)[-1] if "@" in address else ""
+        if domain and self._domain_matches(domain, self.deny_domains):
+            return float("-inf"), ["deny_domain"]
+        if domain and self._domain_matches(domain, self.allow_domains):
+            return float("inf"), ["allow_domain"]
+
+        reasons = []
+        score = self._score_field(self.sender_regex, self.sender_weights, address, reasons)
+        if domain and self._domain_matches(domain, ATS_DOMAINS):
+            score += ATS_DOMAIN_WEIGHT
+            reasons.append("ats_domain")
+        score += self._score_field(self.subject_regex, self.subject_weights, subject or "", reasons)
+        if body:
+            score += self._score_field(self.body_regex, self.body_weights, body[:self.body_chars], reasons)
+        return score, reasons
+
+    def __call__(self, sender, subject, body=""):
+        score, reasons = self.score(sender, subject, body)
+        if score >= self.threshold:
+            return ", ".join(reasons)
+        return None
+
+    def filter_batch(self, emails):
+        """Return the emails (dicts with sender/subject/body) that pass, with their reason attached."""
+        passed = []
+        for email_data in emails:
+            reason = self(email_data.get("sender", ""), email_data.get("subject", ""), email_data.get("body", ""))
+            if reason:
+                passed.append({**email_data, "filter_reason": reason})
+        return passed
+
+
+def default_prefilter():
+    """Prefilter configured from PREFILTER_* environment variables."""
+    return Prefilter(
+        threshold=float(os.getenv("PREFILTER_THRESHOLD", PREFILTER_THRESHOLD)),
+        allow_domains=_domain_list(os.getenv("PREFILTER_ALLOW_DOMAINS")),
+        deny_domains=_domain_list(os.getenv("PREFILTER_DENY_DOMAINS")),
+    )
+
+
+def evaluate(corpus, prefilter=None):
+    """Precision/recall of `prefilter` on labelled emails (dicts with a boolean `job_related`)."""
+    prefilter = prefilter or default_prefilter()
+    tp = fp = fn = tn = 0
+    for email_data in corpus:
+        predicted = bool(prefilter(email_data["sender"], email_data["subject"], email_data.get("body", "")))
+        actual = bool(email_data["job_related"])
+        tp += predicted and actual
+        fp += predicted and not actual
+        fn += actual and not predicted
+        tn += not predicted and not actual
+    return {
+        "total": tp + fp + fn + tn,
+        "passed": tp + fp,
+        "precision": tp / (tp + fp) if tp + fp else 0.0,
+        "recall": tp / (tp + fn) if tp + fn else 0.0,
+        "dropped_fraction": (fn + tn) / (tp + fp + fn + tn) if corpus else 0.0,
+    }
+
+
+def load_corpus(path):
+    with open(path, "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+if __name__ == "__main__":
+    # Usage: python prefilter.py fixtures/prefilter_corpus.jsonl [threshold]
+    corpus_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join("fixtures", "prefilter_corpus.jsonl")
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else PREFILTER_THRESHOLD
+    print(json.dumps(evaluate(load_corpus(corpus_path), Prefilter(threshold=threshold)), indent=2))
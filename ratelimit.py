@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import inc
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+# Gmail allows 250 quota units per user per second; messages.get/list cost 5, history.list 2.
+GMAIL_UNIT_COST = {"messages.get": 5, "messages.list": 5, "history.list": 2, "getProfile": 1}
+
+
+def gmail_units_per_second():
+    """GMAIL_UNITS_PER_SECOND, read when the bucket is built so a .env loaded after import applies."""
+    return float(os.getenv("GMAIL_UNITS_PER_SECOND", "250"))
+
+
+def openai_limits():
+    """(requests, tokens) per minute from OPENAI_RPM / OPENAI_TPM."""
+    return float(os.getenv("OPENAI_RPM", "500")), float(os.getenv("OPENAI_TPM", "30000"))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `rate` tokens per second up to `capacity`.
+    `clock` and `sleep` are injectable so tests can drive it with a fake clock.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost=1.0):
+        """Take `cost` tokens (possibly going negative) and return how long the caller must wait."""
+        with self._lock:
+            self._refill()
+            # Never let a single oversized request wait forever
+            cost = min(cost, self.capacity)
+            self.tokens -= cost
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, cost=1.0):
+        wait = self.reserve(cost)
+        if wait > 0:
+            self.sleep(wait)
+
+    def penalize(self, seconds):
+        """Drain the bucket so nobody sends for `seconds` (used when the server says Retry-After)."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+def http_status(exception):
+    """Status code from an OpenAI APIStatusError or a googleapiclient HttpError, else None."""
+    status = getattr(exception, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exception, "resp", None), "status", None)
+    return int(status) if status is not None else None
+
+
+def retry_after(exception):
+    """Seconds from a Retry-After header on either client's error, else None."""
+    headers = getattr(getattr(exception, "response", None), "headers", None) or getattr(exception, "resp", None)
+    try:
+        value = headers.get("retry-after") if headers is not None else None
+        return float(value) if value is not None else None
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def is_retryable(exception):
+    status = http_status(exception)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # Connection resets and timeouts carry no status code
+    return type(exception).__name__ in {"APIConnectionError", "APITimeoutError", "Timeout", "ConnectionError",
+                                        "TimeoutError", "ConnectionResetError"}
+
+
+def backoff_delay(attempt, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Exponential backoff with jitter between half and the full delay."""
+    return min(max_delay, base_delay * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+
+def call_with_retries(func, bucket=None, cost=1.0, max_retries=MAX_RETRIES, base_delay=BASE_DELAY,
+                      sleep=time.sleep):
+    """
+    Call `func()` after taking `cost` from `bucket`, retrying 429/5xx/connection errors with
+    jittered exponential backoff. A Retry-After header overrides the backoff and also pauses the
+    shared bucket, so other threads stop sending instead of piling more 429s on top.
+    """
+    for attempt in range(max_retries + 1):
+        if bucket is not None:
+            bucket.acquire(cost)
+        try:
+            return func()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            inc("retries", status=http_status(e) or type(e).__name__)
+            delay = retry_after(e)
+            if delay is not None and bucket is not None:
+                bucket.penalize(delay)
+            sleep(delay if delay is not None else backoff_delay(attempt, base_delay))
+
+
+class SharedBucket:
+    """
+    Local face of a TokenBucket living in another process (e.g. a multiprocessing manager proxy):
+    the reservation is made remotely, the wait happens here.
+    """
+
+    def __init__(self, proxy, sleep=time.sleep):
+        self.proxy = proxy
+        self.sleep = sleep
+
+    def acquire(self, cost=1.0):
+        wait = self.proxy.reserve(cost)
+        if wait > 0:
+            self.sleep(wait)
+
+    def penalize(self, seconds):
+        self.proxy.penalize(seconds)
+
+
+class Coalescer:
+    """Runs one call per key at a time; concurrent callers with the same key share its result."""
+
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, func):
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = func()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+_gmail_bucket = None
+_gmail_bucket_lock = threading.Lock()
+
+
+def gmail_execute(request, method="messages.get", count=1, bucket=None):
+    """`request.execute()` under the shared Gmail quota bucket, with retries."""
+    return call_with_retries(request.execute, bucket or gmail_bucket(), GMAIL_UNIT_COST.get(method, 5) * count)
+
+
+def gmail_bucket():
+    """The process-wide Gmail quota bucket, created on first use."""
+    global _gmail_bucket
+    with _gmail_bucket_lock:
+        if _gmail_bucket is None:
+            _gmail_bucket = TokenBucket(gmail_units_per_second())
+        return _gmail_bucket
+
+
+def estimate_tokens(kwargs):
+    """Rough prompt + completion token estimate for TPM accounting."""
+    text = "".join(str(m.get("content", "")) for m in kwargs.get("messages", []))
+    return len(text) // 4 + kwargs.get("max_tokens", 500)
+
+
+class _Completions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, **kwargs):
+        return self.owner.create_completion(**kwargs)
+
+
+class RateLimitedOpenAI:
+    """
+    Wraps an OpenAI client so `client.chat.completions.create(...)` respects RPM/TPM buckets,
+    retries throttling with backoff, and coalesces identical in-flight requests.
+    """
+
+    def __init__(self, client, rpm=None, tpm=None, clock=time.monotonic, sleep=time.sleep,
+                 requests=None, tokens=None):
+        self.client = client
+        default_rpm, default_tpm = openai_limits()
+        rpm = default_rpm if rpm is None else rpm
+        tpm = default_tpm if tpm is None else tpm
+        # Pass `requests`/`tokens` buckets to share one budget with other clients or processes
+        self.requests = requests or TokenBucket(rpm / 60.0, capacity=max(1.0, rpm / 60.0), clock=clock, sleep=sleep)
+        self.tokens = tokens or TokenBucket(tpm / 60.0, capacity=tpm / 6.0, clock=clock, sleep=sleep)
+        self.sleep = sleep
+        self.coalescer = Coalescer()
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = _Completions(self)
+
+    def create_completion(self, **kwargs):
+        key = hashlib.sha256(json.dumps(kwargs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+        def call():
+            self.tokens.acquire(estimate_tokens(kwargs))
+            return call_with_retries(lambda: self.client.chat.completions.create(**kwargs),
+                                     self.requests, sleep=self.sleep)
+
+        return self.coalescer.run(key, call)
+
+
+_openai_client = None
+_openai_lock = threading.Lock()
+
+
+def shared_openai_client(requests=None, tokens=None):
+    """
+    One rate-limited OpenAI client per process, shared by classification and relevance checks.
+    `requests`/`tokens` buckets, honoured on the first call, share the budget across processes.
+    """
+    global _openai_client
+    with _openai_lock:
+        if _openai_client is None:
+            from openai import OpenAI
+            _openai_client = RateLimitedOpenAI(OpenAI(), requests=requests, tokens=tokens)
+        return _openai_client
@@ -1,109 +1,133 @@
-import csv
-import os
-from openai import OpenAI
-
-def load_existing_data(csv_file):
-    """Load data from the CSV file."""
-    if not os.path.exists(csv_file):
-        # Initialize with headers if the file doesn't exist
-        with open(csv_file, "w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["Sender", "Subject", "Body Snippet", "Category", "Decision", "Round", "Status"])
-        return []
-
-    # Load existing rows
-    with open(csv_file, "r", newline="") as file:
-        reader = csv.DictReader(file)
-        return list(reader)
-
-def save_to_csv(data, csv_file):
-    """Save data back to the CSV file."""
-    with open(csv_file, "w", newline="") as file:
-        fieldnames = ["Sender", "Subject", "Body Snippet", "Category", "Decision", "Round", "Status"]
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(data)
-
-def check_relevance_with_gpt(existing_row, email_doc):
+import re
+import sys
+from compaction import RELEVANCE_TOKEN_BUDGET, compact
+from llm_cache import cache_key, get_default_cache
+from metrics import record_completion, span
+from ratelimit import shared_openai_client
+from storage import get_store
+
+# Number of locally shortlisted rows sent to the LLM in one comparison call.
+RELEVANCE_TOP_K = 3
+RELEVANCE_MODEL = "gpt-4"
+RELEVANCE_PROMPT_VERSION = "2"
+
+
+def check_relevance_batch_with_gpt(candidate_rows, email_doc):
     """
-    Use GPT to determine if the email pertains to an existing job based on context.
+    Ask GPT once which (if any) of the shortlisted job rows the new email belongs to.
+    Returns the matching row or None.
     """
-    openaiclient = OpenAI()
+    cache = get_default_cache()
+    key = cache_key("relevance_batch", RELEVANCE_MODEL, RELEVANCE_PROMPT_VERSION,
+                    *(f"{row['Subject']}\n{row['Body Snippet']}" for row in candidate_rows),
+                    email_doc['subject'], email_doc['snippet'])
+    choice = cache.get(key)
+    if choice is None:
+        choice = _ask_relevance_batch(candidate_rows, email_doc)
+        cache.set(key, choice)
+    if 1 <= choice <= len(candidate_rows):
+        return candidate_rows[choice - 1]
+    return None
+
+
+def _ask_relevance_batch(candidate_rows, email_doc):
+    """Send the numbered-choice relevance prompt and return the chosen number (0 for none)."""
+    openaiclient = shared_openai_client()
+    listing = "\n\n".join(
+        f"[{i}] Subject: {row['Subject']}\nBody: {compact(row['Body Snippet'], RELEVANCE_TOKEN_BUDGET)}"
+        for i, row in enumerate(candidate_rows, start=1)
+    )
     prompt = (
-        f"You are an assistant tasked with determining if two emails are related to the same job.\n"
-        f"Here is the existing job email:\n"
-        f"Subject: {existing_row['Subject']}\n"
-        f"Body: {existing_row['Body Snippet']}\n\n"
+        f"You are an assistant tasked with determining if a new email relates to one of several existing jobs.\n"
+        f"Here are the existing job emails:\n{listing}\n\n"
         f"Here is the new email:\n"
         f"Subject: {email_doc['subject']}\n"
-        f"Body: {email_doc['snippet']}\n\n"
-        f"Does the new email build upon or pertain to the same job as the existing job in the row?"
-        f" Reply 'Yes' or 'No' only."
+        f"Body: {compact(email_doc['snippet'], RELEVANCE_TOKEN_BUDGET)}\n\n"
+        f"Which existing job does the new email build upon or pertain to?"
+        f" Reply with the number in brackets only, or 0 if none."
     )
 
-    response = openaiclient.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "system", "content": "You are a helpful assistant."},
-                  {"role": "user", "content": prompt}],
-        max_tokens=5,  
-        temperature=0
-    )
-    
-    answer = response.choices[0].message.content
-    if 'yes' in answer.lower():
-        return True
-    return False
+    with span("llm", purpose="relevance_batch"):
+        response = openaiclient.chat.completions.create(
+            model=RELEVANCE_MODEL,
+            messages=[{"role": "system", "content": "You are a helpful assistant."},
+                      {"role": "user", "content": prompt}],
+            max_tokens=5,
+            temperature=0
+        )
+    record_completion(response, "relevance_batch", RELEVANCE_MODEL)
+
+    match = re.search(r"\d+", response.choices[0].message.content or "")
+    return int(match.group()) if match else 0
+
+
+def find_local_match(store, email_doc):
+    """The stored row for this email's thread, else for its exact sender+subject, else None."""
+    row = store.find_thread(email_doc.get("thread_id"))
+    if row is None:
+        row = store.find_exact(email_doc["sender"], email_doc["subject"])
+    return row
 
 
+@span("relevance")
+def match_job(store, email_doc):
+    """
+    Find the stored row this email belongs to: its thread, then exact sender+subject, then
+    shortlist + one LLM call. The LLM call runs without holding the store lock.
+    """
+    row = find_local_match(store, email_doc)
+    if row is not None:
+        return row
+    candidates = [row for row, _ in store.shortlist(email_doc, k=RELEVANCE_TOP_K)]
+    return check_relevance_batch_with_gpt(candidates, email_doc) if candidates else None
+
+
+def apply_email(store, email_doc, row=None):
+    """
+    Update the matching job's status (`row`, as found by match_job), or add a new row if no
+    job matches. A reply that carries no status of its own ("NA") keeps the job's previous status.
+    """
+    fields = {"Body Snippet": email_doc["snippet"]}
+    if email_doc.get("thread_id"):
+        fields["Thread ID"] = email_doc["thread_id"]
+    status = {
+        "Category": email_doc.get("category", "NA"),
+        "Decision": email_doc.get("decision", "NA"),
+        "Round": email_doc.get("round", "NA"),
+    }
+    # A row added since matching (e.g. earlier in the same batch) takes precedence
+    row = find_local_match(store, email_doc) or row
+    if row is not None:
+        if status["Category"] == "NA":
+            status = {}
+        return store.update(row, Status="Updated", **fields, **status)
+    return store.add({"Sender": email_doc["sender"], "Subject": email_doc["subject"], **fields, **status,
+                      "Status": "New"})
+
 
-def update_or_add_job(csv_file, email_doc):
+def update_or_add_job(csv_file, email_doc, store=None):
     """
-    Update the CSV file to reflect the status of a job.
-    If the job (identified by sender and subject) exists, update its status; otherwise, add a new row.
+    Update the job tracker to reflect the status of a job.
+    If the job (identified by sender and subject, or by LLM relevance) exists, update its status;
+    otherwise, add a new row. Rows live in the store returned by `get_store(csv_file)`.
     """
-    existing_data = load_existing_data(csv_file)
-    updated = False
-
-    # Match existing row based on "Sender" and "Subject"
-    for row in existing_data:
-        if row["Sender"] == email_doc["sender"] and row["Subject"] == email_doc["subject"]:
-            # Update relevant fields
-            row["Body Snippet"] = email_doc["snippet"]
-            row["Category"] = email_doc.get("category", "NA")
-            row["Decision"] = email_doc.get("decision", "NA")
-            row["Round"] = email_doc.get("round", "NA")
-            row["Status"] = "Updated"  # Mark as updated
-            updated = True
-            break
-
-
-    # Use LLM calls to relevance check if no exact match was found
-    if not updated:
-        for row in existing_data:
-            is_relevant = check_relevance_with_gpt(row, email_doc)
-            if is_relevant:
-                # Update relevant fields based on relevance from LLM
-                row["Body Snippet"] = email_doc["snippet"]
-                row["Category"] = email_doc.get("category", "NA")
-                row["Decision"] = email_doc.get("decision", "NA")
-                row["Round"] = email_doc.get("round", "NA")
-                row["Status"] = "Updated"  # Mark as 
-                updated = True
-                break
-
-    # Add a new row if no match found
-    if not updated:
-        new_row = {
-            "Sender": email_doc["sender"],
-            "Subject": email_doc["subject"],
-            "Body Snippet": email_doc["snippet"],
-            "Category": email_doc.get("category", "NA"),
-            "Decision": email_doc.get("decision", "NA"),
-            "Round": email_doc.get("round", "NA"),
-            "Status": "New"
-        }
-        existing_data.append(new_row)
-
-    # Save updated data back to CSV
-    save_to_csv(existing_data, csv_file)
+    store = store or get_store(csv_file)
+    row = match_job(store, email_doc)
+    with store.transaction():
+        return apply_email(store, email_doc, row)
+
+
+def upsert_many(csv_file, email_docs, store=None):
+    """Apply a batch of email docs in a single store transaction; matching happens before it."""
+    store = store or get_store(csv_file)
+    rows = [match_job(store, email_doc) for email_doc in email_docs]
+    with store.transaction():
+        return [apply_email(store, email_doc, row) for email_doc, row in zip(email_docs, rows)]
+
 
+if __name__ == "__main__":
+    # Usage: python save_to_db.py export [job_applications.csv]
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        csv_file = sys.argv[2] if len(sys.argv) > 2 else "job_applications.csv"
+        get_store(csv_file).export_csv(csv_file)
+        print(f"Exported jobs to {csv_file}")
@@ -0,0 +1,250 @@
+import csv
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from job_index import JobIndex, company_name
+
+FIELDNAMES = ["Sender", "Subject", "Body Snippet", "Category", "Decision", "Round", "Status", "Thread ID"]
+JOB_DB_FILE = "job_applications.sqlite3"
+COLUMNS = {
+    "Sender": "sender", "Subject": "subject", "Body Snippet": "body_snippet", "Category": "category",
+    "Decision": "decision", "Round": "round", "Status": "status", "Thread ID": "thread_id",
+}
+
+
+def load_existing_data(csv_file):
+    """Load data from the CSV file."""
+    if not os.path.exists(csv_file):
+        # Initialize with headers if the file doesn't exist
+        with open(csv_file, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(FIELDNAMES)
+        return []
+
+    # Load existing rows
+    with open(csv_file, "r", newline="") as file:
+        reader = csv.DictReader(file)
+        return list(reader)
+
+
+def save_to_csv(data, csv_file):
+    """Save data back to the CSV file, atomically so a crash never truncates it."""
+    tmp_file = f"{csv_file}.tmp"
+    with open(tmp_file, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDNAMES, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(data)
+    os.replace(tmp_file, csv_file)
+
+
+def job_key(row):
+    """Normalized company key for a row, used as a secondary lookup column."""
+    return company_name(row.get("Sender", ""), row.get("Subject", ""), row.get("Body Snippet", ""))
+
+
+class JobStore:
+    """
+    Job rows kept in memory for a whole run, with an exact (sender, subject) lookup and a
+    JobIndex for relevance shortlisting. Subclasses decide how changes reach disk.
+    """
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self._reindex()
+        self._lock = threading.RLock()
+        # (previous contents of updated rows, row count) while a transaction is open
+        self._undo = None
+
+    def _reindex(self):
+        self.index = JobIndex(self.rows)
+        self._exact = {(row["Sender"], row["Subject"]): row for row in self.rows}
+        self._threads = {row["Thread ID"]: row for row in self.rows if row.get("Thread ID")}
+
+    def find_exact(self, sender, subject):
+        return self._exact.get((sender, subject))
+
+    def find_thread(self, thread_id):
+        return self._threads.get(thread_id) if thread_id else None
+
+    def shortlist(self, email_doc, k=3):
+        with self._lock:
+            return self.index.shortlist(email_doc, k=k)
+
+    def add(self, row):
+        self.rows.append(row)
+        self.index.add(row)
+        self._exact[(row["Sender"], row["Subject"])] = row
+        if row.get("Thread ID"):
+            self._threads[row["Thread ID"]] = row
+        self._write(row, new=True)
+        return row
+
+    def update(self, row, **fields):
+        if self._undo is not None:
+            self._undo[0].append((row, dict(row)))
+        row.update(fields)
+        if fields.keys() & {"Sender", "Subject", "Body Snippet", "Thread ID"}:
+            self.index.update(row)
+        if row.get("Thread ID"):
+            self._threads[row["Thread ID"]] = row
+        self._write(row, new=False)
+        return row
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group changes so they reach disk together when the outermost transaction ends.
+        If it fails, the backend and the in-memory rows are both put back as they were.
+        """
+        with self._lock:
+            outermost = self._undo is None
+            if outermost:
+                self._undo = ([], len(self.rows))
+            try:
+                yield self
+                if outermost:
+                    self._commit()
+            except BaseException:
+                if outermost:
+                    self._restore()
+                    self._rollback()
+                raise
+            finally:
+                if outermost:
+                    self._undo = None
+
+    def _restore(self):
+        updated, count = self._undo
+        for row, previous in reversed(updated):
+            row.clear()
+            row.update(previous)
+        added = self.rows[count:]
+        del self.rows[count:]
+        self._forget(added)
+        self._reindex()
+
+    def export_csv(self, csv_file):
+        save_to_csv(self.rows, csv_file)
+
+    def _write(self, row, new):
+        raise NotImplementedError
+
+    def _commit(self):
+        pass
+
+    def _rollback(self):
+        pass
+
+    def _forget(self, rows):
+        """Drop backend bookkeeping for rows whose addition was rolled back."""
+
+    def close(self):
+        pass
+
+
+class CSVJobStore(JobStore):
+    """Legacy backend: the CSV file is rewritten (atomically) once per transaction."""
+
+    def __init__(self, csv_file):
+        self.csv_file = csv_file
+        self._dirty = False
+        super().__init__(load_existing_data(csv_file))
+
+    def _write(self, row, new):
+        self._dirty = True
+
+    def _commit(self):
+        if self._dirty:
+            save_to_csv(self.rows, self.csv_file)
+            self._dirty = False
+
+
+class SQLiteJobStore(JobStore):
+    """Default backend: indexed upserts in SQLite, one database transaction per store transaction."""
+
+    def __init__(self, db_file=JOB_DB_FILE, import_csv=None):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY, sender TEXT NOT NULL, subject TEXT NOT NULL, body_snippet TEXT, "
+            "category TEXT, decision TEXT, round TEXT, status TEXT, job_key TEXT, thread_id TEXT)"
+        )
+        # Databases created before thread tracking lack the column
+        existing = {record[1] for record in self.conn.execute("PRAGMA table_info(jobs)")}
+        if "thread_id" not in existing:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN thread_id TEXT")
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_sender_subject ON jobs (sender, subject)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_job_key ON jobs (job_key)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_thread_id ON jobs (thread_id)")
+        self.conn.commit()
+        self._row_ids = {}
+
+        select = "SELECT id, " + ", ".join(COLUMNS.values()) + " FROM jobs ORDER BY id"
+        rows = []
+        for record in self.conn.execute(select):
+            row = dict(zip(COLUMNS, record[1:]))
+            self._row_ids[id(row)] = record[0]
+            rows.append(row)
+        super().__init__(rows)
+
+        # First run: seed the database from the existing tracker CSV
+        if not rows and import_csv and os.path.exists(import_csv):
+            with self.transaction():
+                for row in load_existing_data(import_csv):
+                    self.add(row)
+
+    def _write(self, row, new):
+        values = [row.get(field) for field in COLUMNS] + [job_key(row)]
+        if id(row) in self._row_ids:
+            assignments = ", ".join(f"{column} = ?" for column in COLUMNS.values())
+            self.conn.execute(f"UPDATE jobs SET {assignments}, job_key = ? WHERE id = ?",
+                              values + [self._row_ids[id(row)]])
+        else:
+            columns = ", ".join(COLUMNS.values())
+            cursor = self.conn.execute(
+                f"INSERT INTO jobs ({columns}, job_key) VALUES ({', '.join('?' * (len(COLUMNS) + 1))}) "
+                f"ON CONFLICT (sender, subject) DO UPDATE SET "
+                + ", ".join(f"{c} = excluded.{c}" for c in list(COLUMNS.values())[2:] + ["job_key"])
+                + " RETURNING id",
+                values,
+            )
+            self._row_ids[id(row)] = cursor.fetchone()[0]
+        if self._undo is None:
+            self.conn.commit()
+
+    def _commit(self):
+        self.conn.commit()
+
+    def _rollback(self):
+        self.conn.rollback()
+
+    def _forget(self, rows):
+        for row in rows:
+            self._row_ids.pop(id(row), None)
+
+    def close(self):
+        self.conn.close()
+
+
+_stores = {}
+
+
+def default_backend():
+    """Backend named by JOB_STORE: "sqlite" (default) or "csv" for the legacy whole-file store."""
+    return os.getenv("JOB_STORE", "sqlite")
+
+
+def get_store(csv_file, backend=None):
+    """Process-wide store for `csv_file`, created on first use and kept for the whole run."""
+    backend = backend or default_backend()
+    key = (backend, os.path.abspath(csv_file))
+    if key not in _stores:
+        if backend == "csv":
+            _stores[key] = CSVJobStore(csv_file)
+        else:
+            db_file = os.path.join(os.path.dirname(os.path.abspath(csv_file)), JOB_DB_FILE)
+            _stores[key] = SQLiteJobStore(db_file, import_csv=csv_file)
+    return _stores[key]
@@ -0,0 +1,239 @@
+import json
+import os
+import re
+import time
+from collections import deque
+
+from metrics import span
+from ratelimit import GMAIL_UNIT_COST, gmail_bucket, gmail_execute
+
+SYNC_STATE_FILE = "sync_state.json"
+GMAIL_HISTORY_URL = "https://gmail.googleapis.com/gmail/v1/users/me/history"
+# How many processed message ids to remember per source, as a guard against reprocessing
+# when a run crashes between handling a message and saving its cursor.
+MAX_PROCESSED_IDS = 5000
+# Runs a message may fail in before it is dead-lettered instead of holding the cursor back.
+MAX_ATTEMPTS = 3
+
+
+class SyncState:
+    """
+    Small JSON-backed store of per-source sync cursors, recently processed ids, failure counts
+    and dead-lettered ids.
+    """
+
+    def __init__(self, path=SYNC_STATE_FILE, max_processed=MAX_PROCESSED_IDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_processed = max_processed
+        self.max_attempts = max_attempts
+        self.data = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                self.data = json.load(file)
+        self._processed = {
+            source: deque(entry.get("processed", []), maxlen=max_processed)
+            for source, entry in self.data.items()
+        }
+        self._processed_sets = {source: set(ids) for source, ids in self._processed.items()}
+
+    def cursor(self, source):
+        return self.data.get(source, {}).get("cursor")
+
+    def set_cursor(self, source, cursor):
+        self.data.setdefault(source, {})["cursor"] = cursor
+
+    def reset(self, source):
+        self.data.pop(source, None)
+        self._processed.pop(source, None)
+        self._processed_sets.pop(source, None)
+
+    def clear_processed(self, source):
+        """Forget processed ids but keep the cursor, failure counts and dead letters."""
+        self.data.get(source, {}).pop("processed", None)
+        self._processed.pop(source, None)
+        self._processed_sets.pop(source, None)
+
+    def is_processed(self, source, message_id):
+        return str(message_id) in self._processed_sets.get(source, ())
+
+    def mark_processed(self, source, message_ids):
+        ids = self._processed.setdefault(source, deque(maxlen=self.max_processed))
+        seen = self._processed_sets.setdefault(source, set())
+        for message_id in map(str, message_ids):
+            if message_id in seen:
+                continue
+            if len(ids) == ids.maxlen:
+                seen.discard(ids[0])
+            ids.append(message_id)
+            seen.add(message_id)
+
+    def record_attempts(self, source, done_ids, failed_ids):
+        """
+        Clear the failure count of `done_ids` and bump it for `failed_ids`. Ids that have failed
+        `max_attempts` runs are dead-lettered and marked processed, so they stop holding the
+        cursor back. Returns the failed ids that are still worth retrying.
+        """
+        entry = self.data.setdefault(source, {})
+        attempts = entry.setdefault("attempts", {})
+        for message_id in map(str, done_ids):
+            attempts.pop(message_id, None)
+        retry, dead = [], []
+        for message_id in failed_ids:
+            key = str(message_id)
+            attempts[key] = attempts.get(key, 0) + 1
+            if attempts[key] >= self.max_attempts:
+                del attempts[key]
+                dead.append(message_id)
+            else:
+                retry.append(message_id)
+        if not attempts:
+            entry.pop("attempts")
+        if dead:
+            print(f"{source}: giving up on {len(dead)} messages after {self.max_attempts} failed runs: {dead}")
+            entry["dead_letter"] = (entry.get("dead_letter", []) + [str(d) for d in dead])[-self.max_processed:]
+            self.mark_processed(source, dead)
+        return retry
+
+    def dead_letters(self, source):
+        return list(self.data.get(source, {}).get("dead_letter", []))
+
+    def save(self):
+        """Write the state atomically so a crash never leaves a half-written file."""
+        for source, ids in self._processed.items():
+            self.data.setdefault(source, {})["processed"] = list(ids)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.data, file)
+        os.replace(tmp_path, self.path)
+
+
+def gmail_window_query(hours=None, unread_only=False):
+    """Build the `-in:sent is:unread after:<epoch>` query used when there is no cursor yet."""
+    query = "-in:sent "
+    if unread_only:
+        query += "is:unread "
+    if hours:
+        query += f"after:{int(time.time() - hours * 3600)} "
+    return query.strip()
+
+
+@span("history_check", source="gmail")
+def gmail_history_unchanged(creds, state, source="gmail"):
+    """
+    True when nothing was added to Gmail since the stored historyId, checked with one plain
+    HTTP request so a quiet run never builds the discovery-based API client. The cursor is
+    moved up to the current historyId. Without a cursor, or on any error, returns False and
+    leaves the decision to `gmail_new_messages`.
+    """
+    history_id = state.cursor(source)
+    if history_id is None:
+        return False
+    from google.auth.transport.requests import AuthorizedSession
+
+    gmail_bucket().acquire(GMAIL_UNIT_COST["history.list"])
+    try:
+        response = AuthorizedSession(creds).get(GMAIL_HISTORY_URL, params={
+            "startHistoryId": history_id, "historyTypes": "messageAdded", "maxResults": 1,
+        }, timeout=30)
+        response.raise_for_status()
+        body = response.json()
+    except Exception as e:
+        print(f"Error checking history: {e}")
+        return False
+    if body.get("history"):
+        return False
+    state.set_cursor(source, body.get("historyId", history_id))
+    state.save()
+    return True
+
+
+@span("list", source="gmail")
+def gmail_new_messages(service, state, source="gmail", hours=1, max_results=150):
+    """
+    Return (messages, cursor) for mail added since the stored Gmail historyId, newest first.
+
+    Without a cursor (first run, or history expired) this falls back to an `after:` window
+    and reads the current historyId *before* listing, so nothing slips between the two.
+    Call `state.set_cursor(source, cursor)` once the messages have been handled.
+    """
+    history_id = state.cursor(source)
+    if history_id is not None:
+        messages, page_token = [], None
+        try:
+            while True:
+                response = gmail_execute(service.users().history().list(
+                    userId='me', startHistoryId=history_id, historyTypes=['messageAdded'],
+                    pageToken=page_token,
+                ), method="history.list")
+                for record in response.get('history', []):
+                    for added in record.get('messagesAdded', []):
+                        # The user's own replies would otherwise become their thread's newest message
+                        if 'SENT' not in added['message'].get('labelIds', []):
+                            messages.append(added['message'])
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+            # History lists additions oldest first; messages().list returns newest first
+            unique = {m['id']: m for m in reversed(messages) if not state.is_processed(source, m['id'])}
+            print(f"Found {len(unique)} new messages since history {history_id}.")
+            return list(unique.values()), response.get('historyId', history_id)
+        except Exception as e:
+            # A 404 means the historyId is too old; anything else is reported and retried next run
+            if getattr(getattr(e, 'resp', None), 'status', None) != 404:
+                print(f"Error fetching history: {e}")
+                return [], history_id
+            print("Stored historyId expired, falling back to a time window.")
+
+    cursor = gmail_execute(service.users().getProfile(userId='me'), method="getProfile")['historyId']
+    # The cursor covers everything in the window, so every page has to be listed
+    messages, page_token = [], None
+    while True:
+        results = gmail_execute(service.users().messages().list(
+            userId='me', maxResults=max_results, q=gmail_window_query(hours=hours), pageToken=page_token,
+        ), method="messages.list")
+        messages.extend(m for m in results.get('messages', []) if not state.is_processed(source, m['id']))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+    print(f"Found {len(messages)} messages.")
+    return messages, cursor
+
+
+def mailbox_status(mail, mailbox, item):
+    """Integer value of one STATUS item (e.g. UIDVALIDITY) for `mailbox`, or None."""
+    status, data = mail.status(mailbox, f"({item})")
+    match = re.search(rf"{item} (\d+)", data[0].decode() if status == "OK" and data else "")
+    return int(match.group(1)) if match else None
+
+
+@span("list", source="imap")
+def imap_new_uids(mail, state, source, mailbox="inbox"):
+    """
+    Return (uids, cursor) for messages added to `mailbox` since the stored cursor.
+
+    The cursor is {uidvalidity, uidnext, highestmodseq}. A changed UIDVALIDITY invalidates
+    every stored UID, so the source is reset. When the server advertises CONDSTORE and
+    neither UIDNEXT nor HIGHESTMODSEQ moved, the mailbox is not searched at all.
+    """
+    uidvalidity = mailbox_status(mail, mailbox, "UIDVALIDITY")
+    uidnext = mailbox_status(mail, mailbox, "UIDNEXT")
+    condstore = "CONDSTORE" in getattr(mail, "capabilities", ())
+    modseq = mailbox_status(mail, mailbox, "HIGHESTMODSEQ") if condstore else None
+    cursor = {"uidvalidity": uidvalidity, "uidnext": uidnext, "highestmodseq": modseq}
+
+    previous = state.cursor(source)
+    if previous and previous.get("uidvalidity") != uidvalidity:
+        print(f"UIDVALIDITY changed for {source}, resyncing.")
+        state.reset(source)
+        previous = None
+
+    if previous is None:
+        return None, cursor
+    if previous.get("uidnext") == uidnext and (modseq is None or previous.get("highestmodseq") == modseq):
+        return [], cursor
+
+    start = previous.get("uidnext") or 1
+    status, data = mail.uid("SEARCH", None, f"UID {start}:*")
+    # `N:*` always matches the highest UID, even when it is below N
+    uids = [int(u) for u in data[0].split() if int(u) >= start] if status == "OK" else []
+    return [u for u in uids if not state.is_processed(source, u)], cursor
@@ -0,0 +1,126 @@
+import base64
+import random
+from email.message import EmailMessage
+
+COMPANIES = ["Stripe", "Ramp", "Anthropic", "DegenAI", "Mila", "Scale AI", "Mistral", "Figma", "Notion", "Cohere"]
+ROLES = ["Software Engineer", "ML Engineer", "Research Scientist", "Data Scientist", "Backend Engineer"]
+JOB_TEMPLATES = [
+    ("Thank you for applying to {company}",
+     "Hi Yash,\n\nThank you for applying to the {role} role at {company}. We have received your application "
+     "and our team will review it shortly.\n\nBest,\n{company} Recruiting"),
+    ("Interview invitation - {role}",
+     "Hi Yash,\n\nWe'd like to invite you to a {round} interview for the {role} position at {company}. "
+     "Please share your availability for next week.\n\nThanks,\nRecruiting team"),
+    ("Update on your application to {company}",
+     "Hi Yash,\n\nUnfortunately we will not be moving forward with your application for {role} at this time. "
+     "We regret that we cannot share more.\n\nBest,\nTalent team"),
+    ("Offer - {role} at {company}",
+     "Hi Yash,\n\nWe are pleased to offer you the {role} position at {company}! Your offer letter is attached."),
+]
+OTHER_TEMPLATES = [
+    ("Your order has shipped", "Your package is on its way. Track it at https://example.com/track?id={n}."),
+    ("Weekly newsletter #{n}", "Top stories this week... Unsubscribe | View in browser | Privacy Policy"),
+    ("Dinner on Sunday?", "Are you coming home this weekend? Love, Mom"),
+    ("[repo] New issue #{n}", "A new issue was opened in your repository by someone."),
+    ("{n}% off everything - sale ends tonight", "Shop the sale now at https://shop.example.com/?utm={n}"),
+]
+JOB_SENDERS = ["recruiting@{domain}", "no-reply@us.greenhouse-mail.io", "careers@{domain}", "talent@{domain}",
+               "no-reply@hire.lever.co"]
+OTHER_SENDERS = ["orders@amazon.com", "noreply@medium.com", "mom@gmail.com", "noreply@github.com", "news@nike.com"]
+# (kind, weight): the mix of MIME shapes in the generated mailbox
+KINDS = [("plain", 40), ("alternative", 30), ("html_only", 15), ("attachment", 10), ("latin1", 5)]
+JOB_FRACTION = 0.2
+ATTACHMENT_BYTES = 2 * 1024 * 1024
+
+
+def _html(text):
+    paragraphs = "".join(f"<p>{line}</p>" for line in text.split("\n") if line)
+    return (f"<html><head><style>p{{margin:0}}</style></head><body>{paragraphs}"
+            f"<div style='display:none'>tracking</div></body></html>")
+
+
+def generate(n, seed=0, job_fraction=JOB_FRACTION):
+    """Deterministic list of message specs: id, thread, sender, subject, text, kind, job_related."""
+    rng = random.Random(seed)
+    kinds = [k for k, w in KINDS for _ in range(w)]
+    specs = []
+    for i in range(n):
+        company = rng.choice(COMPANIES)
+        domain = company.lower().replace(" ", "") + ".com"
+        job_related = rng.random() < job_fraction
+        subject, text = rng.choice(JOB_TEMPLATES if job_related else OTHER_TEMPLATES)
+        fields = {"company": company, "role": rng.choice(ROLES), "round": rng.choice(["first", "second", "final"]),
+                  "n": rng.randint(1, 99)}
+        sender = rng.choice(JOB_SENDERS if job_related else OTHER_SENDERS).format(domain=domain)
+        specs.append({
+            "id": f"m{i:07d}",
+            "thread_id": f"t{company.lower()}{i % 97 if job_related else i}",
+            "sender": f"{company if job_related else 'Sender'} <{sender}>",
+            "subject": subject.format(**fields),
+            "text": text.format(**fields),
+            "kind": rng.choice(kinds),
+            "job_related": job_related,
+        })
+    return specs
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _gmail_part(mime_type, data, charset="utf-8", filename=""):
+    headers = [{"name": "Content-Type", "value": f"{mime_type}; charset=\"{charset}\""}]
+    if filename:
+        headers.append({"name": "Content-Disposition", "value": f"attachment; filename=\"{filename}\""})
+    return {"mimeType": mime_type, "filename": filename, "headers": headers,
+            "body": {"size": len(data), "data": _b64(data)}}
+
+
+def to_gmail_message(spec):
+    """Gmail API `format='full'` message resource for a spec."""
+    text, kind = spec["text"], spec["kind"]
+    if kind == "plain":
+        payload = _gmail_part("text/plain", text.encode("utf-8"))
+    elif kind == "html_only":
+        payload = _gmail_part("text/html", _html(text).encode("utf-8"))
+    elif kind == "latin1":
+        payload = _gmail_part("text/plain", (text + " Café résumé").encode("iso-8859-1"), charset="iso-8859-1")
+    else:
+        alternative = {"mimeType": "multipart/alternative", "headers": [], "body": {"size": 0}, "parts": [
+            _gmail_part("text/plain", text.encode("utf-8")),
+            _gmail_part("text/html", _html(text).encode("utf-8")),
+        ]}
+        payload = alternative
+        if kind == "attachment":
+            payload = {"mimeType": "multipart/mixed", "headers": [], "body": {"size": 0}, "parts": [
+                alternative,
+                _gmail_part("application/pdf", b"%PDF" + b"\0" * ATTACHMENT_BYTES, filename="offer.pdf"),
+            ]}
+    payload["headers"] = payload["headers"] + [
+        {"name": "From", "value": spec["sender"]},
+        {"name": "Subject", "value": spec["subject"]},
+        {"name": "Message-ID", "value": f"<{spec['id']}@synthetic>"},
+    ]
+    return {"id": spec["id"], "threadId": spec["thread_id"], "snippet": text[:100], "payload": payload}
+
+
+def to_rfc822(spec):
+    """RFC822 bytes (as returned by an IMAP FETCH) for a spec."""
+    msg = EmailMessage()
+    msg["From"] = spec["sender"]
+    msg["Subject"] = spec["subject"]
+    msg["Message-ID"] = f"<{spec['id']}@synthetic>"
+    text, kind = spec["text"], spec["kind"]
+    if kind == "plain":
+        msg.set_content(text)
+    elif kind == "html_only":
+        msg.set_content(_html(text), subtype="html")
+    elif kind == "latin1":
+        msg.set_content(text + " Café résumé", charset="iso-8859-1")
+    else:
+        msg.set_content(text)
+        msg.add_alternative(_html(text), subtype="html")
+        if kind == "attachment":
+            msg.add_attachment(b"%PDF" + b"\0" * ATTACHMENT_BYTES, maintype="application", subtype="pdf",
+                               filename="offer.pdf")
+    return msg.as_bytes()
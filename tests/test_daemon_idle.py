@@ -0,0 +1,100 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import daemon
+
+
+class SocketIMAP:
+    """The parts of imaplib.IMAP4 that imap_idle uses, over one end of a socketpair."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.file = sock.makefile("rb")
+        self.tags = 0
+
+    def _new_tag(self):
+        self.tags += 1
+        return b"A%d" % self.tags
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def readline(self):
+        return self.file.readline()
+
+
+@pytest.fixture
+def connection():
+    client, server = socket.socketpair()
+    yield SocketIMAP(client), server
+    client.close()
+    server.close()
+
+
+def serve(server, *replies):
+    """Answer each line the client sends with the next reply."""
+
+    def run():
+        lines = server.makefile("rb")
+        for reply in replies:
+            lines.readline()
+            server.sendall(reply)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_update_sent_with_the_continuation_is_noticed_at_once(connection):
+    mail, server = connection
+    # imaplib reads both lines into its buffer, where select() on the socket cannot see them
+    serve(server, b"+ idling\r\n* 3 EXISTS\r\n", b"A1 OK IDLE terminated\r\n")
+    started = time.monotonic()
+    assert daemon.imap_idle(mail, timeout=10) is True
+    assert time.monotonic() - started < daemon.STOP_CHECK_SECONDS
+
+
+def test_update_arriving_later_wakes_the_idle(connection):
+    mail, server = connection
+    lines = server.makefile("rb")
+
+    def run():
+        lines.readline()
+        server.sendall(b"+ idling\r\n")
+        time.sleep(0.1)
+        server.sendall(b"* 4 EXISTS\r\n")
+        lines.readline()
+        server.sendall(b"A1 OK IDLE terminated\r\n")
+
+    threading.Thread(target=run, daemon=True).start()
+    assert daemon.imap_idle(mail, timeout=10) is True
+
+
+def test_timeout_without_updates_ends_the_idle_cleanly(connection):
+    mail, server = connection
+    serve(server, b"+ idling\r\n", b"A1 OK IDLE terminated\r\n")
+    assert daemon.imap_idle(mail, timeout=0.2) is False
+
+
+def test_stop_event_ends_the_idle(connection):
+    mail, server = connection
+    serve(server, b"+ idling\r\n", b"A1 OK IDLE terminated\r\n")
+    stop = threading.Event()
+    stop.set()
+    assert daemon.imap_idle(mail, timeout=10, stop=stop) is False
+
+
+def test_rejected_idle_raises(connection):
+    mail, server = connection
+    serve(server, b"A1 BAD IDLE not supported\r\n")
+    with pytest.raises(daemon.imaplib.IMAP4.error):
+        daemon.imap_idle(mail, timeout=1)
+
+
+def test_poll_interval_backs_off_and_snaps_back():
+    assert daemon.next_poll_interval(10, found=False, minimum=5, maximum=12) == 12
+    assert daemon.next_poll_interval(4, found=False, minimum=5, maximum=120) == 6
+    assert daemon.next_poll_interval(100, found=True, minimum=5, maximum=120) == 5
@@ -0,0 +1,128 @@
+import base64
+from types import SimpleNamespace
+
+import pytest
+
+import helpers
+import ratelimit
+
+
+class HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = SimpleNamespace(status=status)
+
+
+def gmail_message(message_id, fmt):
+    body = base64.urlsafe_b64encode(f"Body of {message_id}".encode()).decode().rstrip("=")
+    return {
+        "id": message_id, "threadId": f"thread-{message_id}", "snippet": f"snippet {message_id}",
+        "payload": {
+            "mimeType": "text/plain",
+            "headers": [{"name": "From", "value": "Acme <jobs@acme.com>"},
+                        {"name": "Subject", "value": f"Subject {message_id}"}],
+            "body": {"data": body} if fmt == "full" else {},
+        },
+    }
+
+
+class FakeGmail:
+    """
+    Local stand-in for the discovery service's batch endpoint. `outcomes` maps a message id
+    to the HTTP statuses it answers with on successive attempts (200 once those run out).
+    """
+
+    def __init__(self, outcomes=None):
+        self.outcomes = {k: list(v) for k, v in (outcomes or {}).items()}
+        self.batches = []
+        self.formats = set()
+
+    def new_batch_http_request(self, callback):
+        service = self
+
+        class Batch:
+            def __init__(self):
+                self.requests = []
+
+            def add(self, request, request_id):
+                self.requests.append((request_id, request))
+
+            def execute(self):
+                service.batches.append([request_id for request_id, _ in self.requests])
+                for request_id, request in self.requests:
+                    statuses = service.outcomes.get(request_id)
+                    status = statuses.pop(0) if statuses else 200
+                    if status == 200:
+                        callback(request_id, gmail_message(request_id, request["format"]), None)
+                    else:
+                        callback(request_id, None, HttpError(status))
+
+        return Batch()
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def get(self, userId, id, format, **options):
+        self.formats.add(format)
+        return {"id": id, "format": format, **options}
+
+
+@pytest.fixture(autouse=True)
+def unlimited_gmail_quota(monkeypatch):
+    monkeypatch.setattr(ratelimit, "_gmail_bucket", ratelimit.TokenBucket(10 ** 9))
+
+
+def test_fetches_messages_in_batches_in_request_order():
+    service = FakeGmail()
+    ids = [f"m{i}" for i in range(7)]
+    details, failed = helpers.get_full_email_details_batch(service, ids, batch_size=3, sleep=lambda _: None)
+    assert [d["id"] for d in details] == ids
+    assert failed == []
+    assert [len(batch) for batch in service.batches] == [3, 3, 1]
+    assert details[0]["body"] == "Body of m0"
+    assert details[0]["subject"] == "Subject m0"
+
+
+def test_retries_only_throttled_items():
+    service = FakeGmail({"slow": [429, 503]})
+    sleeps = []
+    details, failed = helpers.get_full_email_details_batch(service, ["a", "slow", "b"], sleep=sleeps.append)
+    assert [d["id"] for d in details] == ["a", "slow", "b"]
+    assert failed == []
+    assert service.batches == [["a", "slow", "b"], ["slow"], ["slow"]]
+    assert len(sleeps) == 2
+
+
+def test_reports_failures_and_ignores_deleted_messages():
+    service = FakeGmail({"gone": [404], "forbidden": [403], "throttled": [429] * 10})
+    details, failed = helpers.get_full_email_details_batch(
+        service, ["a", "gone", "forbidden", "throttled"], max_retries=2, sleep=lambda _: None)
+    assert [d["id"] for d in details] == ["a"]
+    assert sorted(failed) == ["forbidden", "throttled"]
+
+
+def test_parallel_workers_each_build_their_own_service():
+    services = []
+
+    def factory():
+        services.append(FakeGmail())
+        return services[-1]
+
+    ids = [f"m{i}" for i in range(10)]
+    details, failed = helpers.get_full_email_details_batch(None, ids, batch_size=2, max_workers=3,
+                                                           service_factory=factory, sleep=lambda _: None)
+    assert [d["id"] for d in details] == ids
+    assert 1 <= len(services) <= 3
+    assert sum(len(s.batches) for s in services) == 5
+
+
+def test_metadata_pass_requests_headers_only():
+    service = FakeGmail()
+    details, failed = helpers.get_email_metadata_batch(service, ["a", "b"], sleep=lambda _: None)
+    assert service.formats == {"metadata"}
+    assert [(d["id"], d["sender"], d["thread_id"]) for d in details] == [
+        ("a", "Acme <jobs@acme.com>", "thread-a"), ("b", "Acme <jobs@acme.com>", "thread-b")]
+    assert failed == []
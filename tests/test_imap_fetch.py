@@ -0,0 +1,135 @@
+import re
+
+import pytest
+
+from fetchemails_via_imap import fetch_emails_imap_pipelined, imap_thread_ids, uid_set
+
+
+def raw_message(uid, subject, body, in_reply_to=None):
+    headers = [
+        f"From: Sender {uid} <sender{uid}@example.com>",
+        f"Subject: {subject}",
+        "Date: Mon, 12 Oct 2026 10:00:00 +0000",
+        f"Message-ID: <msg{uid}@example.com>",
+        "Content-Type: text/plain; charset=utf-8",
+    ]
+    if in_reply_to:
+        headers += [f"In-Reply-To: {in_reply_to}", f"References: {in_reply_to}"]
+    return ("\r\n".join(headers) + "\r\n\r\n" + body).encode()
+
+
+def expand_uid_set(value):
+    uids = []
+    for part in value.split(","):
+        start, _, end = part.partition(":")
+        uids.extend(range(int(start), int(end or start) + 1))
+    return uids
+
+
+class FakeIMAP:
+    """Local IMAP stand-in answering UID SEARCH and UID FETCH the way imaplib returns them."""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.commands = []
+        self.selected = None
+
+    def select(self, mailbox, readonly=False):
+        self.selected = (mailbox, readonly)
+        return "OK", [str(len(self.messages)).encode()]
+
+    def uid(self, command, *args):
+        self.commands.append((command, *args))
+        if command == "SEARCH":
+            return "OK", [" ".join(str(uid) for uid in sorted(self.messages)).encode()]
+        assert command == "FETCH"
+        uids, items = args
+        partial = re.search(r"BODY\.PEEK\[TEXT\]<0\.(\d+)>", items)
+        response = []
+        for uid in expand_uid_set(uids):
+            header, _, body = self.messages[uid].partition(b"\r\n\r\n")
+            if partial:
+                data, name = body[:int(partial.group(1))], b"BODY[TEXT]<0>"
+            else:
+                data, name = header + b"\r\n\r\n", b"BODY[HEADER.FIELDS (...)]"
+            response.append((b"%d (UID %d %s {%d}" % (uid, uid, name, len(data)), data))
+            response.append(b")")
+        return "OK", response
+
+    def fetches(self):
+        return [args for command, *args in self.commands if command == "FETCH"]
+
+
+def interview_only(sender, subject, body=""):
+    return "interview" if "interview" in subject.lower() else None
+
+
+@pytest.fixture
+def mailbox():
+    return FakeIMAP({
+        1: raw_message(1, "Weekly newsletter", "news " * 1000),
+        2: raw_message(2, "Interview invitation", "Can you do Tuesday? " + "x" * 5000),
+        3: raw_message(3, "Sale: 50% off", "buy"),
+        4: raw_message(4, "Your interview loop", "Schedule below."),
+    })
+
+
+def test_uid_set_compresses_ranges():
+    assert uid_set([7, 1, 2, 3, 9, 10]) == "1:3,7,9:10"
+
+
+def test_headers_for_all_then_capped_bodies_for_survivors(mailbox):
+    emails = fetch_emails_imap_pipelined(mail=mailbox, uids=[1, 2, 3, 4], prefilter=interview_only,
+                                         body_bytes=64)
+    header_fetch, body_fetch = mailbox.fetches()
+    # One FETCH per pass, never marking anything \Seen
+    assert header_fetch[0] == "1:4" and "BODY.PEEK[HEADER.FIELDS" in header_fetch[1]
+    assert body_fetch[0] == "2,4" and "BODY.PEEK[TEXT]<0.64>" in body_fetch[1]
+    assert mailbox.selected == ("inbox", True)
+
+    assert [e["uid"] for e in emails] == [4, 2]
+    assert emails[1]["subject"] == "Interview invitation"
+    assert emails[1]["body"].startswith("Can you do Tuesday?")
+    assert len(emails[1]["body"]) <= 64
+    assert emails[1]["message_id"] == "<msg2@example.com>"
+
+
+def test_without_prefilter_every_message_is_fetched(mailbox):
+    emails = fetch_emails_imap_pipelined(mail=mailbox, uids=[1, 3])
+    assert sorted(e["uid"] for e in emails) == [1, 3]
+    assert mailbox.fetches()[1][0] == "1,3"
+
+
+def test_search_picks_the_newest_messages_first(mailbox):
+    emails = fetch_emails_imap_pipelined(mail=mailbox, max_emails=2)
+    assert mailbox.commands[0] == ("SEARCH", None, "ALL")
+    assert [e["uid"] for e in emails] == [4, 3]
+
+
+def test_errors_reach_callers_that_pass_their_own_connection(mailbox):
+    class Broken(FakeIMAP):
+        def uid(self, command, *args):
+            raise OSError("connection reset")
+
+    with pytest.raises(OSError):
+        fetch_emails_imap_pipelined(mail=Broken({}), uids=[1])
+
+
+def test_replies_in_one_thread_are_all_returned_with_their_thread_key():
+    mailbox = FakeIMAP({
+        1: raw_message(1, "Interview invitation", "Tuesday?"),
+        2: raw_message(2, "Re: Interview invitation", "Thanks!", in_reply_to="<msg1@example.com>"),
+    })
+    emails = fetch_emails_imap_pipelined(mail=mailbox, uids=[1, 2])
+    assert [(e["uid"], e["thread_id"]) for e in emails] == [(2, "<msg1@example.com>"), (1, "<msg1@example.com>")]
+
+
+def test_thread_ids_come_from_the_id_headers_alone():
+    mailbox = FakeIMAP({
+        1: raw_message(1, "Interview invitation", "Tuesday?"),
+        2: raw_message(2, "Re: Interview invitation", "Thanks!", in_reply_to="<msg1@example.com>"),
+        3: raw_message(3, "Unrelated", "..."),
+    })
+    assert imap_thread_ids(mailbox, [1, 2, 3]) == {
+        1: "<msg1@example.com>", 2: "<msg1@example.com>", 3: "<msg3@example.com>"}
+    assert "HEADER.FIELDS (MESSAGE-ID IN-REPLY-TO REFERENCES)" in mailbox.fetches()[0][1]
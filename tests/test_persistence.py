@@ -0,0 +1,90 @@
+import pytest
+
+pytest.importorskip("pymongo")
+
+from persistence import MongoSink, doc_key
+
+
+class FakeCollection:
+    """Records index creation and bulk writes; `fail_writes` makes the next writes raise."""
+
+    def __init__(self, fail_writes=0):
+        self.indexes = []
+        self.writes = []
+        self.fail_writes = fail_writes
+
+    def create_index(self, keys, **options):
+        self.indexes.append((keys, options))
+
+    def bulk_write(self, operations, ordered=True):
+        if self.fail_writes:
+            self.fail_writes -= 1
+            raise RuntimeError("network error")
+        assert ordered is False
+        self.writes.append(list(operations))
+
+
+def email_doc(i, **extra):
+    return {"id": f"m{i}", "sender": "jobs@acme.com", "subject": f"Application {i}", "body": "..", **extra}
+
+
+def test_doc_key_prefers_gmail_id_then_message_id_then_content():
+    assert doc_key({"id": "abc", "message_id": "<x@y>"}) == "gmail:abc"
+    assert doc_key({"message_id": "<x@y>"}) == "msgid:<x@y>"
+    first = doc_key({"sender": "a", "subject": "b", "body": "c"})
+    assert first.startswith("sha256:") and first == doc_key({"sender": "a", "subject": "b", "body": "c"})
+
+
+def test_creates_a_unique_index_on_keyed_documents_only():
+    collection = FakeCollection()
+    MongoSink(collection, flush_interval=0)
+    keys, options = collection.indexes[0]
+    assert keys[0][0] == "message_key"
+    assert options["unique"] is True
+    assert options["partialFilterExpression"] == {"message_key": {"$exists": True}}
+
+
+def test_buffers_until_flush_size_and_flushes_the_rest_on_close():
+    collection = FakeCollection()
+    with MongoSink(collection, flush_size=3, flush_interval=0) as sink:
+        for i in range(7):
+            sink.add(email_doc(i))
+        assert [len(ops) for ops in collection.writes] == [3, 3]
+    assert [len(ops) for ops in collection.writes] == [3, 3, 1]
+    assert sink.written == 7
+
+
+def test_failed_flush_keeps_the_operations_for_the_next_one():
+    collection = FakeCollection(fail_writes=1)
+    sink = MongoSink(collection, flush_size=100, flush_interval=0)
+    sink.add(email_doc(1))
+    with pytest.raises(RuntimeError):
+        sink.flush()
+    sink.add(email_doc(2))
+    sink.close()
+    assert [len(ops) for ops in collection.writes] == [2]
+    assert sink.written == 2
+
+
+def test_background_thread_flushes_on_the_interval():
+    collection = FakeCollection()
+    sink = MongoSink(collection, flush_size=100, flush_interval=0.01)
+    sink.add(email_doc(1))
+    for _ in range(500):
+        if collection.writes:
+            break
+        sink._stop.wait(0.01)
+    sink.close()
+    assert [len(ops) for ops in collection.writes] == [1]
+
+
+def test_rerunning_upserts_instead_of_duplicating():
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().email_app.filtered_emails
+    for run in range(2):
+        with MongoSink(collection, flush_interval=0) as sink:
+            for i in range(3):
+                sink.add(email_doc(i, category="Applied" if run == 0 else "Got Interview"))
+    assert collection.count_documents({}) == 3
+    assert {doc["category"] for doc in collection.find()} == {"Got Interview"}
+    assert collection.find_one({"message_key": "gmail:m1"})["subject"] == "Application 1"
@@ -0,0 +1,186 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from ratelimit import Coalescer, RateLimitedOpenAI, TokenBucket, call_with_retries
+
+
+class FakeClock:
+    """Monotonic clock that only moves when something sleeps on it."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ApiError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)} if retry_after else {})
+
+
+def failing(errors, result="ok"):
+    """A callable raising each of `errors` in turn, then returning `result`."""
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return func, calls
+
+
+def test_bucket_allows_a_burst_up_to_capacity_then_waits():
+    clock = FakeClock()
+    bucket = TokenBucket(10, clock=clock, sleep=clock.sleep)
+    for _ in range(10):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire(5)
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_bucket_refills_with_time():
+    clock = FakeClock()
+    bucket = TokenBucket(10, clock=clock, sleep=clock.sleep)
+    bucket.acquire(10)
+    clock.now += 1.0
+    assert bucket.reserve(10) == 0.0
+
+
+def test_oversized_request_waits_for_at_most_a_full_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(10, clock=clock, sleep=clock.sleep)
+    bucket.acquire(10)
+    assert bucket.reserve(1000) == pytest.approx(1.0)
+
+
+def test_penalize_pauses_everyone_for_the_given_time():
+    clock = FakeClock()
+    bucket = TokenBucket(10, clock=clock, sleep=clock.sleep)
+    bucket.penalize(3)
+    assert bucket.reserve(1) == pytest.approx(3.1)
+
+
+def test_retries_throttled_calls_with_backoff():
+    clock = FakeClock()
+    func, calls = failing([ApiError(429), ApiError(503)])
+    assert call_with_retries(func, base_delay=1.0, sleep=clock.sleep) == "ok"
+    assert len(calls) == 3
+    # Jittered between half and the full exponential delay
+    assert 0.5 <= clock.sleeps[0] <= 1.0
+    assert 1.0 <= clock.sleeps[1] <= 2.0
+
+
+def test_retry_after_overrides_backoff_and_pauses_the_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(10, clock=clock, sleep=clock.sleep)
+    func, calls = failing([ApiError(429, retry_after=7)])
+    assert call_with_retries(func, bucket=bucket, sleep=clock.sleep) == "ok"
+    # The retry sleeps 7s; the drained bucket then holds it until one more token has refilled
+    assert clock.sleeps == [7, pytest.approx(0.1)]
+
+
+def test_client_errors_are_not_retried():
+    func, calls = failing([ApiError(400)])
+    with pytest.raises(ApiError):
+        call_with_retries(func, sleep=lambda _: None)
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_retries():
+    func, calls = failing([ApiError(500)] * 10)
+    with pytest.raises(ApiError):
+        call_with_retries(func, max_retries=3, sleep=lambda _: None)
+    assert len(calls) == 4
+
+
+def test_connection_errors_are_retried():
+    func, calls = failing([ConnectionResetError()])
+    assert call_with_retries(func, sleep=lambda _: None) == "ok"
+    assert len(calls) == 2
+
+
+def run_concurrently(coalescer, key, func, callers):
+    """Start `callers` threads on the same key while the first call is still running."""
+    release = threading.Event()
+    results, errors = [], []
+
+    def blocked():
+        release.wait(5)
+        return func()
+
+    def call():
+        try:
+            results.append(coalescer.run(key, blocked))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    # Let every caller reach the in-flight future before the owner finishes
+    deadline = time.monotonic() + 5
+    while key not in coalescer._inflight and time.monotonic() < deadline:
+        time.sleep(0.001)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def test_coalescer_shares_one_call_between_concurrent_callers():
+    calls = []
+    results, errors = run_concurrently(Coalescer(), "k", lambda: calls.append(1) or "answer", callers=5)
+    assert results == ["answer"] * 5 and errors == []
+    assert len(calls) == 1
+
+
+def test_coalescer_shares_exceptions_and_forgets_the_key():
+    coalescer = Coalescer()
+
+    def boom():
+        raise RuntimeError("down")
+
+    results, errors = run_concurrently(coalescer, "k", boom, callers=3)
+    assert results == [] and len(errors) == 3
+    assert coalescer.run("k", lambda: "fresh") == "fresh"
+
+
+class StubCompletions:
+    def __init__(self):
+        self.calls = []
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        time.sleep(0.05)
+        return SimpleNamespace(kwargs=kwargs)
+
+
+def test_rate_limited_openai_coalesces_identical_requests():
+    stub = StubCompletions()
+    clock = FakeClock()
+    client = RateLimitedOpenAI(stub, rpm=6000, tpm=10 ** 7, clock=clock, sleep=clock.sleep)
+    request = {"model": "m", "messages": [{"role": "user", "content": "same"}]}
+    threads = [threading.Thread(target=client.chat.completions.create, kwargs=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(stub.calls) < 4
+    client.chat.completions.create(model="m", messages=[{"role": "user", "content": "different"}])
+    assert stub.calls[-1]["messages"][0]["content"] == "different"
@@ -0,0 +1,103 @@
+import json
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+import benchmark
+import fetch_emails
+from sync_state import SyncState, gmail_history_unchanged
+
+HEAVY_MODULES = ("googleapiclient", "google_auth_oauthlib", "pymongo", "openai", "tiktoken",
+                 "pipeline", "helpers", "local_classifier", "persistence")
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def history(monkeypatch):
+    """Stub google.auth's AuthorizedSession; returns the list of requests it received."""
+    requests = []
+    answer = {}
+
+    class AuthorizedSession:
+        def __init__(self, creds):
+            self.creds = creds
+
+        def get(self, url, params=None, timeout=None):
+            requests.append(params)
+            return FakeResponse(answer["body"])
+
+    transport = types.ModuleType("google.auth.transport.requests")
+    transport.AuthorizedSession = AuthorizedSession
+    for name in ("google", "google.auth", "google.auth.transport"):
+        monkeypatch.setitem(sys.modules, name, types.ModuleType(name))
+    monkeypatch.setitem(sys.modules, "google.auth.transport.requests", transport)
+
+    def respond(body):
+        answer["body"] = body
+        return requests
+
+    return respond
+
+
+def test_parse_importtime():
+    stderr = ("import time: self [us] | cumulative | imported package\n"
+              "import time:       120 |        120 |   json.decoder\n"
+              "import time:       300 |        420 | json\n")
+    assert benchmark.parse_importtime(stderr) == [("json.decoder", 120, 120), ("json", 300, 420)]
+
+
+def test_run_startup_times_a_fresh_interpreter():
+    result = benchmark.run_startup("json", "import json", runs=1)
+    assert result["import_ms"] > 0 and result["modules"] > 0
+    assert any(row["module"] == "json" for row in result["slowest"])
+
+
+def test_no_new_mail_path_does_not_import_heavy_modules():
+    code = f"import json, sys, fetch_emails; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(fetch_emails.__file__))).stdout
+    assert json.loads(output) == []
+
+
+def test_quiet_run_moves_the_cursor_without_building_the_service(history, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    state = SyncState()
+    state.set_cursor("gmail", "100")
+    state.save()
+    requests = history({"historyId": "200"})
+
+    def no_service(creds):
+        raise AssertionError("the Gmail service should not be built when nothing is new")
+
+    monkeypatch.setattr(fetch_emails, "load_credentials", lambda: "creds")
+    monkeypatch.setattr(fetch_emails, "build_gmail_service", no_service)
+    fetch_emails.run()
+    assert requests[0]["startHistoryId"] == "100"
+    assert SyncState().cursor("gmail") == "200"
+
+
+def test_new_history_leaves_the_decision_to_the_full_sync(history, tmp_path):
+    state = SyncState(str(tmp_path / "state.json"))
+    state.set_cursor("gmail", "100")
+    history({"historyId": "300", "history": [{"messagesAdded": [{"message": {"id": "m1"}}]}]})
+    assert gmail_history_unchanged("creds", state) is False
+    assert state.cursor("gmail") == "100"
+
+
+def test_first_run_has_no_cursor_to_check(history, tmp_path):
+    requests = history({"historyId": "1"})
+    assert gmail_history_unchanged("creds", SyncState(str(tmp_path / "state.json"))) is False
+    assert requests == []
@@ -0,0 +1,66 @@
+from threads import group_by_thread, imap_thread_id, process_newest_per_thread
+
+
+class Mailbox:
+    """Pretends to run messages through the pipeline: `jobs` add a row for their thread."""
+
+    def __init__(self, jobs=(), failing=(), rows=()):
+        self.jobs = dict(jobs)
+        self.failing = set(failing)
+        self.rows = set(rows)
+        self.rounds = []
+
+    def run(self, ids):
+        self.rounds.append(list(ids))
+        for message_id in ids:
+            if message_id in self.jobs and message_id not in self.failing:
+                self.rows.add(self.jobs[message_id])
+        return {message_id for message_id in ids if message_id in self.failing}
+
+    def has_row(self, thread):
+        return thread in self.rows
+
+
+def test_imap_thread_id_uses_the_conversation_root():
+    assert imap_thread_id("<c@x>", "<b@x>", "<a@x> <b@x>") == "<a@x>"
+    assert imap_thread_id("<b@x>", "<a@x>") == "<a@x>"
+    assert imap_thread_id("<a@x>") == "<a@x>"
+    assert imap_thread_id("") == ""
+
+
+def test_group_by_thread_keeps_newest_first_and_threadless_messages_apart():
+    items = [("m4", "t1"), ("m3", None), ("m2", "t1"), ("m1", None)]
+    assert group_by_thread(items) == [[("m4", "t1"), ("m2", "t1")], [("m3", None)], [("m1", None)]]
+
+
+def test_older_messages_are_superseded_once_the_thread_has_a_row():
+    mailbox = Mailbox(jobs={"m3": "t1"})
+    done, failed = process_newest_per_thread([("m3", "t1"), ("m2", "t1"), ("m1", "t1")], mailbox.run,
+                                             mailbox.has_row)
+    assert mailbox.rounds == [["m3"]]
+    assert done == ["m3", "m2", "m1"] and failed == []
+
+
+def test_job_email_behind_a_newer_unrelated_reply_is_still_classified():
+    # The newest two messages in t1 are small talk; the interview invite (m1) is further back
+    mailbox = Mailbox(jobs={"m1": "t1", "x1": "t2"})
+    items = [("m3", "t1"), ("x1", "t2"), ("m2", "t1"), ("m1", "t1")]
+    done, failed = process_newest_per_thread(items, mailbox.run, mailbox.has_row)
+    assert mailbox.rounds == [["m3", "x1"], ["m2"], ["m1"]]
+    assert sorted(done) == ["m1", "m2", "m3", "x1"] and failed == []
+    assert mailbox.rows == {"t1", "t2"}
+
+
+def test_tracked_thread_only_runs_its_newest_message():
+    mailbox = Mailbox(rows={"t1"})
+    done, failed = process_newest_per_thread([("m2", "t1"), ("m1", "t1")], mailbox.run, mailbox.has_row)
+    assert mailbox.rounds == [["m2"]]
+    assert done == ["m2", "m1"]
+
+
+def test_failure_leaves_the_older_messages_of_its_thread_untouched():
+    mailbox = Mailbox(jobs={"m1": "t1"}, failing={"m3"})
+    done, failed = process_newest_per_thread([("m3", "t1"), ("m2", "t1"), ("m1", "t1"), ("y", "t2")],
+                                             mailbox.run, mailbox.has_row)
+    assert failed == ["m3"]
+    assert done == ["y"]
@@ -0,0 +1,61 @@
+import re
+
+MESSAGE_ID_REGEX = re.compile(r"<[^<>\s]+>")
+
+
+def imap_thread_id(message_id, in_reply_to="", references=""):
+    """
+    Thread key for an RFC822 message: the root Message-ID from References, else the parent
+    from In-Reply-To, else the message's own Message-ID. Replies therefore share their
+    conversation's first message id.
+    """
+    for header in (references, in_reply_to, message_id):
+        ids = MESSAGE_ID_REGEX.findall(header or "")
+        if ids:
+            return ids[0]
+    return ""
+
+
+def group_by_thread(items):
+    """
+    Group (message id, thread id) pairs, given newest first, into per-thread lists that keep
+    that order. Messages without a thread id each form their own group.
+    """
+    groups, index = [], {}
+    for message_id, thread in items:
+        if thread and thread in index:
+            groups[index[thread]].append((message_id, thread))
+            continue
+        if thread:
+            index[thread] = len(groups)
+        groups.append([(message_id, thread)])
+    return groups
+
+
+def process_newest_per_thread(items, run, has_row):
+    """
+    Run (message id, thread id) pairs, newest first, through `run(ids) -> failed ids`, one
+    message per thread per round. Once a thread has a job row (`has_row(thread)`) after its
+    message went through, its older messages are superseded; otherwise the next older one
+    gets a turn, so a job email behind newer unrelated replies is still classified. A failed
+    message ends its thread's turn, leaving the older ones for the retry.
+
+    Returns (done ids, failed ids); done includes the superseded ids.
+    """
+    done, failed = [], []
+    groups = group_by_thread(items)
+    while groups:
+        failed_now = set(run([group[0][0] for group in groups]))
+        remaining = []
+        for group in groups:
+            (message_id, thread), older = group[0], group[1:]
+            if message_id in failed_now:
+                failed.append(message_id)
+            elif older and not has_row(thread):
+                done.append(message_id)
+                remaining.append(older)
+            else:
+                done.append(message_id)
+                done.extend(older_id for older_id, _ in older)
+        groups = remaining
+    return done, failed